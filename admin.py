@@ -0,0 +1,68 @@
+# admin.py - các endpoint quản trị (profiler, ...) được bảo vệ bằng ADMIN_TOKEN
+import os
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from metrics import metrics
+from profiler import profiler
+
+# Không đặt ADMIN_TOKEN => toàn bộ /admin bị khoá
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+def is_admin_token(value: Optional[str]) -> bool:
+    """So sánh token quản trị (constant-time)."""
+    if not ADMIN_TOKEN or not value:
+        return False
+    return hmac.compare_digest(value, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@router.get("/metrics")
+def metrics_snapshot():
+    return metrics.snapshot()
+
+
+# ---------------------------
+# Profiler
+class ProfilerConfig(BaseModel):
+    enabled: bool
+    sample_rate: float = 0.0  # % request được lấy mẫu (0-100)
+
+
+@router.get("/profiler")
+def profiler_status():
+    return profiler.status()
+
+
+@router.post("/profiler")
+def profiler_configure(cfg: ProfilerConfig):
+    if not 0 <= cfg.sample_rate <= 100:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 100")
+    profiler.configure(cfg.enabled, cfg.sample_rate)
+    return profiler.status()
+
+
+@router.get("/profiler/stacks", response_class=PlainTextResponse)
+def profiler_stacks(endpoint: Optional[str] = None):
+    # Định dạng "folded" (flamegraph.pl / speedscope đọc trực tiếp)
+    return profiler.folded(endpoint)
+
+
+@router.delete("/profiler/stacks")
+def profiler_reset():
+    profiler.reset()
+    return {"ok": True}
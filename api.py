@@ -1,16 +1,13 @@
 # api_mock.py - FastAPI backend stable mock (generate không cần LLM)
 import sys, os
-import json
-from datetime import datetime, timedelta
+from datetime import date
 from typing import List, Optional
-from sqlite3 import IntegrityError, OperationalError, DatabaseError
 import traceback
 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import jwt
-from passlib.context import CryptContext
 
 # ---------------------------
 # Đảm bảo Python thấy các module cùng thư mục
@@ -20,20 +17,17 @@ if current_dir not in sys.path:
 
 # ---------------------------
 # Import DB helpers
-from db import init_db, create_user, get_user_by_email, save_history, get_history_for_user
-
-# ---------------------------
-# Password hashing
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
-# CONFIG
-SECRET_KEY = os.environ.get("SECRET_KEY", "change_this_secret_for_prod")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
-
-# App init
+from db import create_user, get_user_by_email, update_password_hash, save_history, get_history_for_user
+import admin
+from profiler import install_profiler, run_in_threadpool
+from itinerary_builder import build_days
+from auth import get_current_user_id, issue_session, refresh_session, revoke_refresh_token
+from passwords import hash_password, verify_password, check_rate_limit, shutdown_pool
+from migrations import check_schema
+from idempotency import run_idempotent
+
+# App init (schema do `python migrations.py` tạo; worker chỉ kiểm tra version lúc startup)
 app = FastAPI()
-init_db()
 
 # CORS
 app.add_middleware(
@@ -44,6 +38,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiler + admin endpoints
+install_profiler(app)
+app.include_router(admin.router)
+
+@app.on_event("startup")
+def _startup():
+    check_schema()
+
+@app.on_event("shutdown")
+def _shutdown():
+    shutdown_pool()
+
 # ---------------------------
 # Pydantic models
 class ItineraryRequest(BaseModel):
@@ -62,34 +68,21 @@ class TokenResp(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
-# ---------------------------
-# Auth helpers
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = int(payload.get("sub"))
-        return user_id
-    except Exception:
-        return None
+class RefreshReq(BaseModel):
+    refresh_token: str
 
 # ---------------------------
 # Endpoints: register / login
 @app.post("/register")
-def register(user: UserCreate):
+async def register(user: UserCreate, request: Request):
+    check_rate_limit(user.email, request.client.host if request.client else None)
     try:
-        existing = get_user_by_email(user.email)
+        existing = await run_in_threadpool(get_user_by_email, user.email)
         if existing:
             raise HTTPException(status_code=400, detail="Email already registered")
-        pw_hash = pwd_context.hash(user.password)
-        uid = create_user(user.email, pw_hash)
-        token = create_access_token({"sub": str(uid)})
-        return {"user_id": uid, "access_token": token}
+        pw_hash = await hash_password(user.password)
+        uid = await run_in_threadpool(create_user, user.email, pw_hash)
+        return await run_in_threadpool(issue_session, uid)
     except HTTPException:
         raise
     except Exception as e:
@@ -97,77 +90,77 @@ def register(user: UserCreate):
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
 @app.post("/login")
-def login(user: UserCreate):
+async def login(user: UserCreate, request: Request):
+    check_rate_limit(user.email, request.client.host if request.client else None)
     try:
-        existing = get_user_by_email(user.email)
-        if not existing or not pwd_context.verify(user.password, existing["password_hash"]):
+        existing = await run_in_threadpool(get_user_by_email, user.email)
+        if not existing:
             raise HTTPException(status_code=401, detail="Invalid credentials")
-        token = create_access_token({"sub": str(existing["id"])})
-        return {"user_id": existing["id"], "access_token": token}
+        ok, new_hash = await verify_password(user.password, existing["password_hash"])
+        if not ok:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if new_hash:
+            await run_in_threadpool(update_password_hash, existing["id"], new_hash)
+        return await run_in_threadpool(issue_session, existing["id"])
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
+@app.post("/token/refresh")
+def token_refresh(body: RefreshReq):
+    tokens = refresh_session(body.refresh_token)
+    if tokens is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return tokens
+
+@app.post("/token/revoke")
+def token_revoke(body: RefreshReq):
+    revoke_refresh_token(body.refresh_token)
+    return {"ok": True}
+
 # ---------------------------
 # Helper: generate mock itinerary
+def parse_dates(req: ItineraryRequest):
+    try:
+        start = date.fromisoformat(req.start_date)
+        end = date.fromisoformat(req.end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must be after start_date")
+    return start, end
+
 def generate_mock_itinerary(req: ItineraryRequest):
-    days = []
-    # tạo 1 day = start_date, bạn có thể loop nhiều ngày nếu muốn
-    days.append({
-        "date": req.start_date,
-        "morning": {
-            "time": "08:00",
-            "title": f"Morning activity in {req.origin}",
-            "explain": "Enjoy local attractions."
-        },
-        "afternoon": {
-            "time": "13:00",
-            "title": f"Afternoon activity in {req.destination}",
-            "explain": "Visit museums or parks."
-        },
-        "evening": {
-            "time": "18:00",
-            "title": "Evening entertainment",
-            "explain": "Explore nightlife or relax."
-        }
-    })
-    return {"days": days}
+    start, end = parse_dates(req)
+    return {"days": build_days(start, end, req.interests, req.pace)}
 
 # ---------------------------
 # Protected generate endpoint
-@app.post("/generate")
-def generate(req: ItineraryRequest, authorization: Optional[str] = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
-    parts = authorization.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-    token = parts[1]
-    user_id = verify_token(token)
-    if user_id is None:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
+def generate_and_save(req: ItineraryRequest, user_id: int) -> dict:
+    itinerary = generate_mock_itinerary(req)
     try:
-        itinerary = generate_mock_itinerary(req)
         save_history(user_id, req.dict(), itinerary)
         return itinerary
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Generate failed: {str(e)}")
 
+@app.post("/generate")
+async def generate(req: ItineraryRequest, idempotency_key: Optional[str] = Header(None),
+                   user_id: int = Depends(get_current_user_id)):
+    if idempotency_key is None:
+        return await run_in_threadpool(generate_and_save, req, user_id)
+
+    async def compute():
+        return JSONResponse(await run_in_threadpool(generate_and_save, req, user_id))
+    # cùng key => trả lại kết quả lần đầu, không lưu history lần nữa
+    return await run_idempotent(f"generate:{user_id}", idempotency_key, req.dict(), compute)
+
 # ---------------------------
 # History endpoint
 @app.get("/history")
-def history(authorization: Optional[str] = Header(None), limit: int = 50):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
-    parts = authorization.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid authorization header")
-    token = parts[1]
-    user_id = verify_token(token)
-    if user_id is None:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
+def history(limit: int = 50, user_id: int = Depends(get_current_user_id)):
     items = get_history_for_user(user_id, limit=limit)
     return {"history": items}
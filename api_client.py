@@ -0,0 +1,154 @@
+# api_client.py - HTTP client cho Streamlit frontend (session keep-alive dùng chung)
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+
+class ApiError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class TripApiClient:
+    """Client của backend FastAPI.
+
+    Một instance dùng chung cho mọi phiên Streamlit (st.cache_resource), nên
+    không giữ token: token được truyền vào từng lời gọi.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 10, retries: int = 3, backoff: float = 0.3):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        # Retry lỗi kết nối cho mọi method; retry theo status chỉ cho GET
+        # (urllib3 mặc định không retry POST sau khi request đã gửi đi)
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # gzip/deflate, thêm br nếu urllib3 giải nén được (có cài brotli)
+        accept_encoding = make_headers(accept_encoding=True)["accept-encoding"]
+        self.session.headers.update({"Accept-Encoding": accept_encoding, "Accept": "application/json"})
+
+    def _request(self, method: str, path: str, token: Optional[str] = None,
+                 timeout: float = 10, **kwargs) -> requests.Response:
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        r = self.session.request(method, f"{self.base_url}{path}", headers=headers, timeout=timeout, **kwargs)
+        if r.status_code >= 400:
+            try:
+                detail = r.json().get("detail", r.text)
+            except ValueError:
+                detail = r.text
+            raise ApiError(r.status_code, str(detail))
+        return r
+
+    # ---------------------------
+    # Auth
+    def login(self, email: str, password: str) -> Dict[str, Any]:
+        return self._request("POST", "/login", json={"email": email, "password": password}).json()
+
+    def register(self, email: str, password: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        return self._request("POST", "/register", json={"email": email, "password": password}, headers=headers).json()
+
+    def refresh(self, refresh_token: str) -> Dict[str, Any]:
+        return self._request("POST", "/token/refresh", json={"refresh_token": refresh_token}).json()
+
+    def revoke(self, refresh_token: str):
+        self._request("POST", "/token/revoke", json={"refresh_token": refresh_token})
+
+    # ---------------------------
+    # Itinerary
+    def generate(self, token: str, payload: Dict[str, Any], timeout: float = 200,
+                 idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """idempotency_key: gửi lại cùng key khi thử lại => server trả kết quả
+        của lần đầu thay vì sinh + lưu history lần nữa."""
+        # báo server thời gian mình còn chờ để server bỏ việc khi quá hạn
+        headers = {"X-Deadline-Ms": str(int(timeout * 1000))}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        return self._request("POST", "/generate", token=token, json=payload, timeout=timeout, headers=headers).json()
+
+    def generate_batch(self, token: str, payloads: List[Dict[str, Any]], timeout: float = 600) -> List[Dict[str, Any]]:
+        """Kết quả theo đúng thứ tự; item lỗi có "ok": False."""
+        return self._request("POST", "/generate/batch", token=token, json=payloads, timeout=timeout).json()["results"]
+
+    def generate_stream(self, token: str, payload: Dict[str, Any], timeout: float = 200,
+                        idempotency_key: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """POST /generate/stream; trả về iterator các dòng NDJSON đã parse.
+
+        Lỗi HTTP (401, ...) được raise ngay khi gọi, trước khi đọc dòng nào;
+        lỗi khi đã gửi vài ngày tới dưới dạng dòng cuối {"error": {"status", "detail"}}.
+        idempotency_key: như generate().
+        """
+        headers = {"X-Deadline-Ms": str(int(timeout * 1000))}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        r = self._request("POST", "/generate/stream", token=token, json=payload, timeout=timeout,
+                          headers=headers, stream=True)
+
+        def lines():
+            with r:
+                for line in r.iter_lines():
+                    if line:
+                        yield json.loads(line)
+        return lines()
+
+    def edit_slot(self, token: str, history_id: int, day_index: int, slot: str,
+                  title: str, explain: str = "", time: Optional[str] = None) -> Dict[str, Any]:
+        body = {"title": title, "explain": explain, "time": time}
+        return self._request("PUT", f"/history/{history_id}/days/{day_index}/{slot}", token=token, json=body).json()
+
+    def regenerate_slot(self, token: str, history_id: int, day_index: int, slot: str,
+                        hint: Optional[str] = None, timeout: float = 60) -> Dict[str, Any]:
+        """Sinh lại một slot; trả {"value": {...}, "version", ...}."""
+        headers = {"X-Deadline-Ms": str(int(timeout * 1000))}
+        return self._request("POST", f"/history/{history_id}/days/{day_index}/{slot}/regenerate", token=token,
+                             json={"hint": hint}, timeout=timeout, headers=headers).json()
+
+    def history_versions(self, token: str, history_id: int) -> List[Dict[str, Any]]:
+        return self._request("GET", f"/history/{history_id}/versions", token=token).json()["versions"]
+
+    def history_version(self, token: str, history_id: int, version: int) -> Dict[str, Any]:
+        return self._request("GET", f"/history/{history_id}/versions/{version}", token=token).json()
+
+    def save_revision(self, token: str, history_id: int, itinerary: Dict[str, Any]) -> int:
+        """Lưu itinerary đã sửa thành version mới; trả số version."""
+        return self._request("POST", f"/history/{history_id}/versions", token=token,
+                             json={"days": itinerary["days"]}).json()["version"]
+
+    def history(self, token: str, limit: int = 50, since_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Lịch sử mới nhất trước; since_id => mọi bản ghi mới hơn (theo từng
+        trang `limit` bản, server báo "has_more")."""
+        if since_id is None:
+            return self._request("GET", "/history", token=token, params={"limit": limit}).json().get("history", [])
+        items: List[Dict[str, Any]] = []
+        while True:
+            body = self._request("GET", "/history", token=token,
+                                 params={"limit": limit, "since_id": since_id}).json()
+            page = body.get("history", [])
+            items = page + items
+            if not page or not body.get("has_more"):
+                return items
+            since_id = page[0]["id"]
+
+    def history_if_changed(self, token: str, limit: int = 50,
+                           etag: Optional[str] = None) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+        """GET /history có điều kiện (If-None-Match).
+
+        Trả về (None, etag) nếu server báo 304 - dữ liệu cache vẫn đúng.
+        """
+        headers = {"If-None-Match": etag} if etag else {}
+        r = self._request("GET", "/history", token=token, params={"limit": limit}, headers=headers)
+        if r.status_code == 304:
+            return None, etag
+        return r.json().get("history", []), r.headers.get("ETag")
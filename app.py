@@ -1,17 +1,135 @@
 # app.py - Streamlit front-end with auth & history
 import streamlit as st
-import requests
+import hashlib
+import json
+import uuid
 from datetime import date
 
+import history_cache
+from api_client import ApiError, TripApiClient
+from itinerary_view import StreamingItinerary, render_itinerary
+
 API_URL = st.secrets.get("API_URL", "http://localhost:8000")
+HISTORY_LIMIT = 50
+
+@st.cache_resource
+def get_client() -> TripApiClient:
+    # Một session keep-alive dùng chung cho mọi lần rerun / mọi phiên
+    return TripApiClient(API_URL)
+
+client = get_client()
 
 st.set_page_config(page_title="Trip Planner", layout="wide")
 st.title("Trip Planner ✈️")
 
 # Init session
-for key, value in [("token", None), ("user_id", None), ("history", []), ("selected_history", None), ("last_itinerary", None)]:
+for key, value in [("token", None), ("refresh_token", None), ("user_id", None), ("history", []), ("history_etag", None), ("selected_history", None), ("last_itinerary", None), ("pending_keys", {})]:
     st.session_state.setdefault(key, value)
 
+# ---------------- Auth helpers
+def save_tokens(data):
+    st.session_state["token"] = data["access_token"]
+    st.session_state["refresh_token"] = data.get("refresh_token")
+    st.session_state["user_id"] = data["user_id"]
+
+def refresh_tokens() -> bool:
+    """Gia hạn access token bằng refresh token (không cần login lại)."""
+    refresh_token = st.session_state.get("refresh_token")
+    if not refresh_token:
+        return False
+    try:
+        save_tokens(client.refresh(refresh_token))
+    except Exception:
+        return False
+    return True
+
+# ---------------- History (cache local + ETag)
+def set_history(items, etag=None):
+    st.session_state["history"] = items[:HISTORY_LIMIT]
+    st.session_state["history_etag"] = etag
+    history_cache.save(API_URL, st.session_state["user_id"], st.session_state["history"], etag)
+
+def load_history():
+    """Sau login: hiện ngay lịch sử cache local, rồi xác thực lại với server."""
+    cached = history_cache.load(API_URL, st.session_state["user_id"]) or {}
+    st.session_state["history"] = cached.get("items", [])
+    st.session_state["history_etag"] = cached.get("etag")
+    sync_history()
+
+def sync_history():
+    """GET /history với If-None-Match: không đổi => 304, không tải body.
+    ETag đổi cả khi bản ghi cũ được sửa / nâng cấp tại chỗ (bản degraded),
+    nên không chỉ lấy các bản ghi mới hơn (since_id)."""
+    etag = st.session_state.get("history_etag")
+    items, etag = with_token(lambda token: client.history_if_changed(token, HISTORY_LIMIT, etag))
+    if items is not None:
+        set_history(items, etag)
+
+def generate_itinerary(payload):
+    """Dùng /generate/stream để hiện từng ngày ngay khi có; backend không hỗ trợ
+    stream (404) thì quay về /generate. Cả hai gửi cùng Idempotency-Key: bấm
+    lại / thử lại khi chưa thành công không tạo thêm bản ghi history."""
+    key = idempotency_key("generate", payload)
+    try:
+        lines = with_token(lambda token: client.generate_stream(token, payload, idempotency_key=key))
+    except ApiError as e:
+        if e.status_code != 404:
+            raise
+        result = with_token(lambda token: client.generate(token, payload, idempotency_key=key))
+        clear_idempotency_key("generate")
+        return result
+
+    view = StreamingItinerary()
+    result = {"days": view.days}
+    try:
+        for line in lines:
+            if "day" in line:
+                view.append(line["day"])
+            elif "error" in line:
+                # lỗi sau khi đã nhận vài ngày: history không được lưu, bấm lại sẽ sinh lại
+                raise ApiError(line["error"]["status"], line["error"]["detail"])
+            elif line.get("done"):
+                result.update(history_id=line.get("history_id"), history=line.get("history"),
+                              degraded=line.get("degraded", False))
+    finally:
+        view.finish()
+    if "history_id" not in result:
+        raise ApiError(502, "Stream ended before the itinerary was saved")
+    clear_idempotency_key("generate")
+    return result
+
+def idempotency_key(action: str, data) -> str:
+    """Cùng thao tác + cùng dữ liệu chưa thành công => dùng lại key cũ, để lần
+    bấm lại / thử lại nhận kết quả của lần đầu thay vì tạo bản mới."""
+    digest = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    pending = st.session_state["pending_keys"].get(action)
+    if pending is None or pending[0] != digest:
+        pending = (digest, uuid.uuid4().hex)
+        st.session_state["pending_keys"][action] = pending
+    return pending[1]
+
+def clear_idempotency_key(action: str):
+    st.session_state["pending_keys"].pop(action, None)
+
+def itinerary_key(data, history_id=None) -> str:
+    """Khoá cache của day_blocks: gồm digest các ngày để đổi theo nội dung
+    (slot đã sửa, bản degraded được nâng cấp, ...)."""
+    digest = hashlib.md5(json.dumps(data.get("days", []), sort_keys=True).encode()).hexdigest()
+    if history_id is None:
+        history_id = data.get("history_id")
+    if history_id is not None:
+        return f"h{history_id}-{digest}"
+    return "x" + digest
+
+def with_token(call):
+    """Gọi `call(token)`; gặp 401 thì refresh token rồi thử lại 1 lần."""
+    try:
+        return call(st.session_state["token"])
+    except ApiError as e:
+        if e.status_code != 401 or not refresh_tokens():
+            raise
+    return call(st.session_state["token"])
+
 # ---------------- Sidebar (Login - Account - History)
 with st.sidebar:
     st.header("🔐 Tài khoản")
@@ -24,13 +142,8 @@ with st.sidebar:
 
         if st.button("Login ✅"):
             try:
-                r = requests.post(f"{API_URL}/login",
-                                  json={"email": email, "password": password},
-                                  timeout=10)
-                r.raise_for_status()
-                data = r.json()
-                st.session_state["token"] = data["access_token"]
-                st.session_state["user_id"] = data["user_id"]
+                save_tokens(client.login(email, password))
+                load_history()
                 st.success("Login thành công ✅")
             except Exception as e:
                 st.error(f"Login failed ❌: {e}")
@@ -44,13 +157,10 @@ with st.sidebar:
 
         if st.button("Register & Login ✅"):
             try:
-                r = requests.post(f"{API_URL}/register",
-                                  json={"email": reg_email, "password": reg_pass},
-                                  timeout=10)
-                r.raise_for_status()
-                data = r.json()
-                st.session_state["token"] = data["access_token"]
-                st.session_state["user_id"] = data["user_id"]
+                key = idempotency_key("register", reg_email)
+                save_tokens(client.register(reg_email, reg_pass, idempotency_key=key))
+                clear_idempotency_key("register")
+                load_history()
                 st.success("Đăng ký + đăng nhập ✅")
             except Exception as e:
                 st.error(f"Đăng ký thất bại ❌: {e}")
@@ -58,19 +168,19 @@ with st.sidebar:
     else:
         st.success(f"✅ Đã đăng nhập: {st.session_state['user_id']}")
         if st.button("Đăng xuất"):
-            st.session_state.update({"token": None, "user_id": None, "history": [], "selected_history": None})
+            if st.session_state.get("refresh_token"):
+                try:
+                    client.revoke(st.session_state["refresh_token"])
+                except Exception:
+                    pass
+            st.session_state.update({"token": None, "refresh_token": None, "user_id": None, "history": [], "history_etag": None, "selected_history": None})
             st.rerun()
 
         st.markdown("---")
 
         if st.button("🔄 Tải lịch sử"):
             try:
-                headers = {"Authorization": f"Bearer {st.session_state['token']}"}
-                r = requests.get(f"{API_URL}/history?limit=50",
-                                 headers=headers,
-                                 timeout=10)
-                r.raise_for_status()
-                st.session_state["history"] = r.json().get("history", [])
+                sync_history()
                 st.success("Đã tải lịch sử ✅")
             except Exception as e:
                 st.error(f"Lỗi tải lịch sử ❌: {e}")
@@ -115,20 +225,23 @@ if st.button("🧠 Generate itinerary"):
             "interests": interests,
             "pace": pace
         }
-        headers = {"Authorization": f"Bearer {st.session_state['token']}"}
 
         with st.spinner("⏳ Đang tạo lịch trình..."):
             try:
-                r = requests.post(f"{API_URL}/generate",
-                                  json=payload, headers=headers, timeout=200)
-                r.raise_for_status()
-                st.session_state["last_itinerary"] = r.json()
+                result = generate_itinerary(payload)
+                st.session_state["last_itinerary"] = result
                 st.success("✅ Thành công — Lịch trình đã được lưu vào History")
+                if result.get("degraded"):
+                    st.info("Server đang quá tải: đây là lịch trình tạm, bản đầy đủ sẽ được cập nhật vào History.")
 
-                # refresh history
-                st.session_state["history"] = requests.get(
-                    f"{API_URL}/history?limit=50",
-                    headers=headers).json().get("history", [])
+                summary = result.get("history")
+                if summary:
+                    # thêm trực tiếp vào sidebar, không cần gọi lại /history
+                    item = {"id": summary["id"], "version": 1, "created_at": summary["created_at"],
+                            "request": payload, "response": {"days": result.get("days", [])}}
+                    set_history([item] + st.session_state["history"])
+                else:
+                    sync_history()
 
             except Exception as e:
                 st.error(f"Server Error ❌: {e}")
@@ -138,19 +251,33 @@ st.markdown("---")
 st.subheader("📌 Lịch trình hiển thị")
 
 display_data = None
+display_key = None
 
 if st.session_state.get("selected_history"):
-    display_data = st.session_state["selected_history"]["response"]
+    selected = st.session_state["selected_history"]
+    display_data = selected["response"]
+    display_key = itinerary_key(display_data, selected["id"])
+
+    with st.expander("✏️ Đổi một hoạt động"):
+        st.caption(f"Phiên bản {selected.get('version', 1)}")
+        days = display_data.get("days", [])
+        day_index = st.selectbox("Ngày", range(len(days)), format_func=lambda i: days[i].get("date", str(i + 1)))
+        slot = st.selectbox("Buổi", ["morning", "afternoon", "evening"])
+        hint = st.text_input("Gợi ý (tuỳ chọn)", key="slot_hint")
+        if st.button("🔄 Gợi ý hoạt động khác"):
+            try:
+                res = with_token(lambda token: client.regenerate_slot(token, selected["id"], day_index, slot, hint or None))
+                days[day_index][slot] = res["value"]
+                selected["version"] = res["version"]
+                set_history(st.session_state["history"])
+                st.rerun()
+            except Exception as e:
+                st.error(f"Không đổi được ❌: {e}")
 elif st.session_state.get("last_itinerary"):
     display_data = st.session_state["last_itinerary"]
+    display_key = itinerary_key(display_data)
 
 if not display_data:
     st.info("Chưa có nội dung. Hãy tạo lịch trình hoặc chọn lịch sử!")
 else:
-    for day in display_data.get("days", []):
-        st.markdown(f"### 📅 {day.get('date', '')}")
-        for slot in ["morning", "afternoon", "evening"]:
-            s = day.get(slot)
-            if s and isinstance(s, dict):
-                st.markdown(f"**{slot.capitalize()} — {s.get('title', '')}**")
-                st.markdown(f"`{s.get('time', '')}` — {s.get('explain', '')}")
+    render_itinerary(display_data, display_key)
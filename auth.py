@@ -0,0 +1,151 @@
+# auth.py - JWT helpers dùng chung cho main.py / api.py
+import os
+import time
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException, Header
+
+from db import create_session, get_session, rotate_session, revoke_session, revoke_user_sessions
+
+# Config
+SECRET_KEY = os.environ.get("SECRET_KEY", "change_this_secret_for_prod")
+ALGORITHM = "HS256"
+# Access token ngắn hạn; client gia hạn bằng refresh token qua /token/refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", "300"))  # giây
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """LRU các token đã verify: sha256(token) -> (user_id, hết hạn lúc).
+
+    Entry hết hạn ở min(exp của token, lúc cache + ttl) nên token hết hạn
+    không bao giờ được trả về từ cache.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: int = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return token_digest(token)
+
+    def get(self, key: bytes) -> Optional[int]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return user_id
+
+    def put(self, key: bytes, user_id: int, exp: Optional[float]):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._data[key] = (user_id, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+token_cache = VerifiedTokenCache()
+
+# ---------------------------
+# Auth helpers
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def verify_token(token: str):
+    key = token_cache.key(token)
+    user_id = token_cache.get(key)
+    if user_id is not None:
+        return user_id
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id = int(payload.get("sub"))
+    except Exception:
+        return None
+    token_cache.put(key, user_id, payload.get("exp"))
+    return user_id
+
+# ---------------------------
+# Refresh token sessions
+def _new_refresh_token():
+    token = secrets.token_urlsafe(32)
+    expires_at = int(time.time()) + REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600
+    return token, token_digest(token), expires_at
+
+def _token_response(user_id: int, refresh_token: str) -> dict:
+    return {
+        "user_id": user_id,
+        "access_token": create_access_token({"sub": str(user_id)}),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
+
+def issue_session(user_id: int) -> dict:
+    """Cấp access token + refresh token mới (sau login/register)."""
+    token, digest, expires_at = _new_refresh_token()
+    create_session(user_id, digest, expires_at)
+    return _token_response(user_id, token)
+
+def refresh_session(refresh_token: str) -> Optional[dict]:
+    """Đổi refresh token lấy cặp token mới (rotation).
+
+    Refresh token đã bị thu hồi mà vẫn được dùng lại => coi như bị lộ, thu
+    hồi toàn bộ session của user đó.
+    """
+    session = get_session(token_digest(refresh_token))
+    if not session or session["expires_at"] < time.time():
+        return None
+    if session["revoked"]:
+        revoke_user_sessions(session["user_id"])
+        return None
+    token, digest, expires_at = _new_refresh_token()
+    if not rotate_session(session["id"], session["user_id"], digest, expires_at):
+        revoke_user_sessions(session["user_id"])
+        return None
+    return _token_response(session["user_id"], token)
+
+def revoke_refresh_token(refresh_token: str) -> bool:
+    return revoke_session(token_digest(refresh_token))
+
+# ---------------------------
+# FastAPI dependency
+async def get_current_user_id(authorization: Optional[str] = Header(None)) -> int:
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authorization header")
+    user_id = verify_token(parts[1])
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
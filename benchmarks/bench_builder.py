@@ -0,0 +1,67 @@
+# bench_builder.py - đo itinerary_builder với khoảng ngày dài và batch
+#
+#   python benchmarks/bench_builder.py [--days 365] [--batch 100]
+import os
+import sys
+import argparse
+import timeit
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from itinerary_builder import build_batch, build_days, slot_templates
+
+
+def legacy_days(start: date, end: date):
+    # vòng lặp cũ của main.generate: dựng lại toàn bộ dict lồng nhau mỗi ngày
+    days = []
+    for i in range((end - start).days + 1):
+        current_date = start + timedelta(days=i)
+        days.append({
+            "date": current_date.isoformat(),
+            "morning": {"time": "08:00", "title": "Morning walk", "explain": "Explore local streets."},
+            "afternoon": {"time": "13:00", "title": "Museum visit", "explain": "Enjoy history and culture."},
+            "evening": {"time": "18:00", "title": "Dinner & Nightlife", "explain": "Try local cuisine."},
+        })
+    return days
+
+
+def peak_alloc(fn) -> int:
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def bench(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    start = date(2025, 1, 1)
+    end = start + timedelta(days=args.days - 1)
+    interests, pace = ["Food", "Museums", "Nature"], "normal"
+    slot_templates.cache_clear()
+    build_days(start, end, interests, pace)  # warm template cache
+
+    t_legacy = bench(lambda: legacy_days(start, end), args.number)
+    t_builder = bench(lambda: build_days(start, end, interests, pace), args.number)
+    m_legacy = peak_alloc(lambda: legacy_days(start, end))
+    m_builder = peak_alloc(lambda: build_days(start, end, interests, pace))
+    print(f"{args.days}-day range")
+    print(f"  legacy loop : {t_legacy:9.1f} µs  peak {m_legacy / 1024:8.1f} KiB")
+    print(f"  builder     : {t_builder:9.1f} µs  peak {m_builder / 1024:8.1f} KiB  "
+          f"({t_legacy / t_builder:.1f}x faster, {m_legacy / m_builder:.1f}x less memory)")
+
+    specs = [(start + timedelta(days=i), start + timedelta(days=i + 6), interests, pace) for i in range(args.batch)]
+    t_batch = bench(lambda: build_batch(specs), max(1, args.number // 5))
+    print(f"batch of {args.batch} x 7-day requests: {t_batch:9.1f} µs ({t_batch / args.batch:.1f} µs / request)")
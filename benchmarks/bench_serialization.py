@@ -0,0 +1,74 @@
+# bench_serialization.py - so sánh serialize + nén cho 1 trang /history (50 item)
+#
+#   python benchmarks/bench_serialization.py [--items 50] [--days 7]
+import argparse
+import gzip
+import json
+import timeit
+from datetime import date, timedelta
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_history(items: int, days: int):
+    out = []
+    for i in range(items):
+        start = date(2025, 1, 1) + timedelta(days=i)
+        req = {"origin": "Hà Nội", "destination": "Đà Nẵng", "start_date": start.isoformat(),
+               "end_date": (start + timedelta(days=days - 1)).isoformat(),
+               "interests": ["Food", "Nature"], "pace": "normal"}
+        resp = {"days": [{
+            "date": (start + timedelta(days=d)).isoformat(),
+            "morning": {"time": "08:00", "title": f"Chợ Hàn #{d}", "explain": "Ăn sáng với mì Quảng và cà phê muối."},
+            "afternoon": {"time": "13:00", "title": f"Bán đảo Sơn Trà #{d}", "explain": "Ngắm voọc chà vá và biển Mỹ Khê."},
+            "evening": {"time": "18:00", "title": f"Cầu Rồng #{d}", "explain": "Xem cầu phun lửa và dạo sông Hàn."},
+        } for d in range(days)]}
+        out.append({"id": i + 1, "request": req, "response": resp, "created_at": f"2025-01-01T00:00:{i:02d}"})
+    return {"history": out}
+
+
+def fastapi_default(content) -> bytes:
+    # JSONResponse.render sau bước jsonable_encoder của FastAPI
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_direct(content) -> bytes:
+    return orjson.dumps(content)
+
+
+def bench(fn, content, number: int) -> float:
+    return min(timeit.repeat(lambda: fn(content), number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    content = make_history(args.items, args.days)
+    print(f"/history page: {args.items} items x {args.days} days")
+    print("serialization (µs / response, best of 5)")
+    t_default = bench(fastapi_default, content, args.number)
+    t_orjson = bench(orjson_direct, content, args.number)
+    print(f"  jsonable_encoder + json.dumps : {t_default:10.1f}")
+    print(f"  orjson.dumps                  : {t_orjson:10.1f}  ({t_default / t_orjson:.1f}x faster)")
+
+    body = orjson_direct(content)
+    print("bytes on wire")
+    print(f"  identity       : {len(body):8d}")
+    gz = gzip.compress(body, compresslevel=9)  # GZipMiddleware mặc định level 9
+    print(f"  gzip (level 9) : {len(gz):8d}  ({len(gz) / len(body):.1%})")
+    if brotli is not None:
+        br = brotli.compress(body, quality=4)  # BrotliMiddleware mặc định quality 4
+        print(f"  brotli (q=4)   : {len(br):8d}  ({len(br) / len(body):.1%})")
+    else:
+        print("  brotli         :   (pip install brotli để đo)")
@@ -0,0 +1,79 @@
+# cost_model.py - ước lượng số token output của một itinerary trước khi sinh
+#
+# tokens ≈ BASE + số ngày * (a[pace] + b[pace] * số interests)
+# a, b được hiệu chỉnh từ history đã lưu (độ dài response_json / CHARS_PER_TOKEN);
+# chưa đủ dữ liệu thì dùng giá trị mặc định.
+import os
+import json
+import threading
+from datetime import date
+from typing import Iterable, Sequence, Tuple
+
+from db import get_history_sizes
+
+CHARS_PER_TOKEN = 4.0
+BASE_TOKENS = 20.0
+DEFAULT_PER_DAY = 80.0       # token / ngày với 1 interest
+DEFAULT_PER_INTEREST = 6.0   # token / ngày cho mỗi interest thêm
+MIN_SAMPLES = 20             # số mẫu tối thiểu của một pace để hiệu chỉnh
+# Trần cost / request: ~ 60 ngày đầy đủ. Vượt trần => từ chối ngay, không xếp hàng.
+MAX_REQUEST_TOKENS = int(os.environ.get("MAX_REQUEST_TOKENS", "8000"))
+
+
+def request_shape(start: date, end: date, interests: Sequence[str], pace: str) -> Tuple[int, int, str]:
+    """(số ngày, số interest khác nhau, pace) - đặc trưng dùng để ước lượng."""
+    n_interests = len({i.strip().lower() for i in interests if i.strip()})
+    pace = (pace or "normal").strip().lower()
+    return (end - start).days + 1, n_interests, pace
+
+
+def _fit(points):
+    """Hồi quy tuyến tính tokens/ngày theo số interest: trả (a, b)."""
+    n = len(points)
+    mx = sum(x for x, _ in points) / n
+    my = sum(y for _, y in points) / n
+    var = sum((x - mx) ** 2 for x, _ in points)
+    b = sum((x - mx) * (y - my) for x, y in points) / var if var else 0.0
+    b = max(0.0, b)
+    return max(1.0, my - b * mx), b
+
+
+class CostModel:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coef = {}  # pace -> (a, b)
+
+    def estimate(self, days: int, n_interests: int, pace: str) -> float:
+        with self._lock:
+            a, b = self._coef.get(pace, (DEFAULT_PER_DAY, DEFAULT_PER_INTEREST))
+        return BASE_TOKENS + days * (a + b * max(0, n_interests - 1))
+
+    def estimate_request(self, start: date, end: date, interests: Sequence[str], pace: str) -> float:
+        return self.estimate(*request_shape(start, end, interests, pace))
+
+    def calibrate(self, samples: Iterable[Tuple[int, int, str, float]]) -> dict:
+        """samples: (số ngày, số interest, pace, số token thực tế)."""
+        by_pace = {}
+        for days, n_interests, pace, tokens in samples:
+            if days > 0:
+                by_pace.setdefault(pace, []).append((max(0, n_interests - 1), max(0.0, tokens - BASE_TOKENS) / days))
+        coef = {pace: _fit(points) for pace, points in by_pace.items() if len(points) >= MIN_SAMPLES}
+        with self._lock:
+            self._coef.update(coef)
+        return {pace: {"per_day": round(a, 1), "per_interest": round(b, 1)} for pace, (a, b) in coef.items()}
+
+    def calibrate_from_history(self, limit: int = 2000) -> dict:
+        samples = []
+        for request_json, response_chars in get_history_sizes(limit):
+            try:
+                req = json.loads(request_json)
+                start = date.fromisoformat(req["start_date"][:10])
+                end = date.fromisoformat(req["end_date"][:10])
+                shape = request_shape(start, end, req.get("interests") or [], req.get("pace"))
+            except (ValueError, KeyError, TypeError):
+                continue
+            samples.append((*shape, response_chars / CHARS_PER_TOKEN))
+        return self.calibrate(samples)
+
+
+cost_model = CostModel()
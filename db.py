@@ -1,10 +1,15 @@
 # db.py
+import os
 import sqlite3
 import json
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict, Iterator
+
+from itinerary_patch import apply_patch, diff_itinerary
 
 DB_FILE = "data.db"
+# số version giữa hai snapshot đầy đủ của một itinerary (giới hạn số delta phải áp khi đọc)
+HISTORY_REBASE_EVERY = int(os.environ.get("HISTORY_REBASE_EVERY", "16"))
 
 def get_conn() -> sqlite3.Connection:
     """Trả về kết nối DB, đảm bảo an toàn cho FastAPI/multithread."""
@@ -13,36 +18,6 @@ def get_conn() -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row  # Giúp truy cập kết quả bằng tên cột
     return conn
 
-def init_db():
-    """Khởi tạo các bảng Users và History."""
-    print("Initializing database...")
-    conn = get_conn()
-    c = conn.cursor()
-    
-    # users table: Email phải là UNIQUE
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL,
-        created_at TEXT
-    )
-    """)
-    # history table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        request_json TEXT NOT NULL,
-        response_json TEXT NOT NULL,
-        created_at TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id)
-    )
-    """)
-    conn.commit()
-    conn.close()
-    print("Database initialization complete.")
-
 # user helper
 def create_user(email: str, password_hash: str) -> int:
     """Tạo người dùng mới và trả về ID. Có thể raise IntegrityError."""
@@ -83,8 +58,120 @@ def get_user_by_id(user_id: int) -> Optional[Dict]:
     # Trả về dict từ sqlite3.Row
     return dict(row)
 
+def update_password_hash(user_id: int, password_hash: str):
+    """Ghi lại hash mật khẩu (khi nâng cấp số vòng lúc login)."""
+    conn = get_conn()
+    try:
+        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+# session helper
+def create_session(user_id: int, token_hash: bytes, expires_at: int) -> int:
+    """Tạo session refresh token; đồng thời dọn các session hết hạn của user."""
+    conn = get_conn()
+    c = conn.cursor()
+    now = datetime.utcnow()
+    try:
+        c.execute("DELETE FROM sessions WHERE user_id = ? AND expires_at < ?",
+                  (user_id, int(now.timestamp())))
+        c.execute("INSERT INTO sessions (user_id, token_hash, expires_at, created_at) VALUES (?,?,?,?)",
+                  (user_id, token_hash, expires_at, now.isoformat()))
+        conn.commit()
+        return c.lastrowid
+    finally:
+        conn.close()
+
+def get_session(token_hash: bytes) -> Optional[Dict]:
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT id, user_id, expires_at, revoked FROM sessions WHERE token_hash = ?", (token_hash,))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return dict(row)
+
+def rotate_session(session_id: int, user_id: int, new_token_hash: bytes, expires_at: int) -> bool:
+    """Thu hồi session cũ và tạo session mới trong cùng transaction.
+    Trả về False nếu session cũ đã bị thu hồi trước đó (token bị dùng lại)."""
+    conn = get_conn()
+    c = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    try:
+        c.execute("UPDATE sessions SET revoked = 1 WHERE id = ? AND revoked = 0", (session_id,))
+        if c.rowcount != 1:
+            conn.rollback()
+            return False
+        c.execute("INSERT INTO sessions (user_id, token_hash, expires_at, created_at) VALUES (?,?,?,?)",
+                  (user_id, new_token_hash, expires_at, now))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def revoke_session(token_hash: bytes) -> bool:
+    conn = get_conn()
+    try:
+        cur = conn.execute("UPDATE sessions SET revoked = 1 WHERE token_hash = ? AND revoked = 0", (token_hash,))
+        conn.commit()
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+def revoke_user_sessions(user_id: int):
+    conn = get_conn()
+    try:
+        conn.execute("UPDATE sessions SET revoked = 1 WHERE user_id = ? AND revoked = 0", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+# idempotency helper
+def claim_idempotency_key(key_hash: bytes, fingerprint: bytes, now: int, lock_until: int) -> Optional[Dict]:
+    """Giữ key cho request hiện tại. Trả về None nếu giữ được, ngược lại trả
+    bản ghi đang có {"fingerprint", "status", "response"} (status None = đang xử lý).
+    Bản ghi hết hạn (kể cả lock của worker đã chết) được dọn trước."""
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        c.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+        c.execute("INSERT OR IGNORE INTO idempotency_keys (key_hash, fingerprint, expires_at) VALUES (?,?,?)",
+                  (key_hash, fingerprint, lock_until))
+        conn.commit()
+        if c.rowcount == 1:
+            return None
+        c.execute("SELECT fingerprint, status, response FROM idempotency_keys WHERE key_hash = ?", (key_hash,))
+        row = c.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def finish_idempotency_key(key_hash: bytes, status: int, response: bytes, expires_at: int):
+    conn = get_conn()
+    try:
+        conn.execute("UPDATE idempotency_keys SET status = ?, response = ?, expires_at = ? WHERE key_hash = ?",
+                     (status, response, expires_at, key_hash))
+        conn.commit()
+    finally:
+        conn.close()
+
+def release_idempotency_key(key_hash: bytes):
+    """Request lỗi: bỏ key để lần thử lại được xử lý từ đầu."""
+    conn = get_conn()
+    try:
+        conn.execute("DELETE FROM idempotency_keys WHERE key_hash = ? AND status IS NULL", (key_hash,))
+        conn.commit()
+    finally:
+        conn.close()
+
 # history helper
 def save_history(user_id: int, request_obj: dict, response_obj: dict) -> int:
+    return save_history_entry(user_id, request_obj, response_obj)["id"]
+
+def save_history_entry(user_id: int, request_obj: dict, response_obj: dict) -> Dict:
+    """Lưu lịch sử, trả về {"id", "created_at"} của bản ghi vừa tạo."""
     conn = get_conn()
     c = conn.cursor()
     now = datetime.utcnow().isoformat()
@@ -92,24 +179,267 @@ def save_history(user_id: int, request_obj: dict, response_obj: dict) -> int:
         c.execute("INSERT INTO history (user_id, request_json, response_json, created_at) VALUES (?,?,?,?)",
                   (user_id, json.dumps(request_obj, ensure_ascii=False), json.dumps(response_obj, ensure_ascii=False), now))
         conn.commit()
-        hid = c.lastrowid
-        return hid
+        return {"id": c.lastrowid, "created_at": now}
+    finally:
+        conn.close()
+
+def save_history_many(user_id: int, items: List[tuple]) -> List[Dict]:
+    """Lưu nhiều (request_obj, response_obj) trong một transaction."""
+    conn = get_conn()
+    c = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    out = []
+    try:
+        for request_obj, response_obj in items:
+            c.execute("INSERT INTO history (user_id, request_json, response_json, created_at) VALUES (?,?,?,?)",
+                      (user_id, json.dumps(request_obj, ensure_ascii=False), json.dumps(response_obj, ensure_ascii=False), now))
+            out.append({"id": c.lastrowid, "created_at": now})
+        conn.commit()
+        return out
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
 
-def get_history_for_user(user_id: int, limit: int = 100) -> List[Dict]:
+def get_history_sizes(limit: int = 2000) -> List[tuple]:
+    """(request_json, độ dài response_json) của các bản ghi mới nhất - để hiệu chỉnh cost model.
+    Bỏ bản "degraded" (dựng từ builder, không phải output của model) chưa được nâng cấp."""
     conn = get_conn()
     c = conn.cursor()
-    c.execute("SELECT id, request_json, response_json, created_at FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit))
-    rows = c.fetchall()
+    c.execute("SELECT request_json, length(response_json) FROM history "
+              "WHERE json_extract(response_json, '$.degraded') IS NULL ORDER BY id DESC LIMIT ?", (limit,))
+    rows = [(r[0], r[1]) for r in c.fetchall()]
     conn.close()
+    return rows
+
+def get_history_version(user_id: int) -> tuple:
+    """(id lớn nhất, số bản ghi, số lần sửa) của user: đổi khi history thay đổi, dùng làm ETag."""
+    conn = get_conn()
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(id), 0), COUNT(*), "
+              "(SELECT COALESCE(MAX(revision), 0) FROM history_revisions WHERE user_id = ?) "
+              "FROM history WHERE user_id = ?", (user_id, user_id))
+    row = c.fetchone()
+    conn.close()
+    return row[0], row[1], row[2]
+
+def _bump_history_revision(c: sqlite3.Cursor, user_id: int):
+    c.execute("INSERT INTO history_revisions (user_id, revision) VALUES (?, 1) "
+              "ON CONFLICT(user_id) DO UPDATE SET revision = revision + 1", (user_id,))
+
+def upgrade_history_response(user_id: int, entry_id: int, response_obj: dict) -> bool:
+    """Thay itinerary "degraded" bằng bản đầy đủ. Không làm gì (False) nếu bản
+    ghi đã bị xoá, không còn là bản degraded hoặc user đã sửa slot."""
+    conn = get_conn()
+    c = conn.cursor()
+    try:
+        c.execute("UPDATE history SET response_json = ? WHERE id = ? AND user_id = ? "
+                  "AND json_extract(response_json, '$.degraded') = 1 "
+                  "AND NOT EXISTS (SELECT 1 FROM history_versions WHERE history_id = history.id)",
+                  (json.dumps(response_obj, ensure_ascii=False), entry_id, user_id))
+        if c.rowcount != 1:
+            conn.rollback()
+            return False
+        _bump_history_revision(c, user_id)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+def _reconstruct(conn: sqlite3.Connection, history_id: int, base_json: str,
+                 version: Optional[int] = None) -> tuple:
+    """(itinerary, version) tại `version` (None = mới nhất): lấy snapshot gần
+    nhất <= version (hoặc bản gốc = version 1) rồi áp các delta sau nó -
+    tối đa HISTORY_REBASE_EVERY delta."""
+    target = version if version is not None else 2 ** 62
+    row = conn.execute("SELECT version, snapshot_json FROM history_versions WHERE history_id = ? AND version <= ? "
+                       "AND snapshot_json IS NOT NULL ORDER BY version DESC LIMIT 1", (history_id, target)).fetchone()
+    current, doc = (row[0], json.loads(row[1])) if row else (1, json.loads(base_json))
+    for v, patch_json in conn.execute("SELECT version, patch_json FROM history_versions WHERE history_id = ? "
+                                      "AND version > ? AND version <= ? ORDER BY version",
+                                      (history_id, current, target)):
+        apply_patch(doc, json.loads(patch_json), in_place=True)
+        current = v
+    return doc, current
+
+def _versioned_items(conn: sqlite3.Connection, history_ids: List[int]) -> Dict[int, str]:
+    """JSON của các item có nhiều version: phải dựng lại bản mới nhất (chỉ các bản ghi đã sửa)."""
+    marks = ",".join("?" * len(history_ids))
+    out = {}
+    for hid, request_json, response_json, created_at in conn.execute(
+            f"SELECT id, request_json, response_json, created_at FROM history WHERE id IN ({marks})", history_ids).fetchall():
+        response, version = _reconstruct(conn, hid, response_json)
+        out[hid] = json.dumps({"id": hid, "version": version, "request": json.loads(request_json),
+                               "response": response, "created_at": created_at}, ensure_ascii=False)
+    return out
+
+def get_history_entry(user_id: int, entry_id: int, version: Optional[int] = None) -> Optional[Dict]:
+    """Một bản ghi history của user tại `version` (mặc định mới nhất), None nếu không có."""
+    conn = get_conn()
+    try:
+        row = conn.execute("SELECT id, request_json, response_json, created_at FROM history WHERE id = ? AND user_id = ?",
+                           (entry_id, user_id)).fetchone()
+        if not row:
+            return None
+        response, current = _reconstruct(conn, entry_id, row["response_json"], version)
+        if version is not None and current != version:
+            return None
+        return {
+            "id": row["id"],
+            "version": current,
+            "request": json.loads(row["request_json"]),
+            "response": response,
+            "created_at": row["created_at"],
+        }
+    finally:
+        conn.close()
+
+def list_history_versions(user_id: int, entry_id: int) -> Optional[List[Dict]]:
+    """Các version của một bản ghi: version 1 là bản gốc (đầy đủ), sau đó là delta."""
+    conn = get_conn()
+    try:
+        row = conn.execute("SELECT created_at, length(response_json) FROM history WHERE id = ? AND user_id = ?",
+                           (entry_id, user_id)).fetchone()
+        if not row:
+            return None
+        out = [{"version": 1, "created_at": row[0], "stored": "full", "bytes": row[1]}]
+        for v, created_at, patch_len, snapshot_len in conn.execute(
+                "SELECT version, created_at, length(patch_json), length(snapshot_json) FROM history_versions "
+                "WHERE history_id = ? ORDER BY version", (entry_id,)):
+            out.append({"version": v, "created_at": created_at, "stored": "snapshot" if snapshot_len else "delta",
+                        "bytes": patch_len + (snapshot_len or 0)})
+        return out
+    finally:
+        conn.close()
+
+def add_history_version(user_id: int, entry_id: int, make_ops: Callable[[dict], List[dict]]) -> Optional[int]:
+    """Tạo version mới: make_ops(itinerary hiện tại) -> delta (JSON Patch).
+
+    Trả về số version mới (hoặc version hiện tại nếu delta rỗng), None nếu bản
+    ghi không thuộc user. Mỗi HISTORY_REBASE_EVERY version lưu kèm snapshot
+    đầy đủ để dựng lại version bất kỳ không phải áp chuỗi delta dài.
+    """
+    conn = get_conn()
+    c = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    try:
+        c.execute("BEGIN IMMEDIATE")  # đánh số version không bị trùng khi ghi đồng thời
+        row = c.execute("SELECT response_json FROM history WHERE id = ? AND user_id = ?", (entry_id, user_id)).fetchone()
+        if not row:
+            conn.rollback()
+            return None
+        doc, version = _reconstruct(conn, entry_id, row[0])
+        ops = make_ops(doc)
+        if not ops:
+            conn.rollback()
+            return version
+        apply_patch(doc, ops, in_place=True)
+        version += 1
+        snapshot = json.dumps(doc, ensure_ascii=False) if (version - 1) % HISTORY_REBASE_EVERY == 0 else None
+        c.execute("INSERT INTO history_versions (history_id, version, patch_json, snapshot_json, created_at) "
+                  "VALUES (?,?,?,?,?)", (entry_id, version, json.dumps(ops, ensure_ascii=False), snapshot, now))
+        _bump_history_revision(c, user_id)
+        conn.commit()
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def add_history_patch(user_id: int, entry_id: int, ops: List[dict]) -> Optional[int]:
+    """Version mới từ một patch có sẵn (vd sửa 1 slot)."""
+    return add_history_version(user_id, entry_id, lambda doc: ops)
+
+def save_history_revision(user_id: int, entry_id: int, response_obj: dict) -> Optional[int]:
+    """Version mới từ itinerary đầy đủ: chỉ lưu delta so với version hiện tại."""
+    return add_history_version(user_id, entry_id, lambda doc: diff_itinerary(doc, response_obj))
+
+def get_history_for_user(user_id: int, limit: int = 100, since_id: Optional[int] = None) -> List[Dict]:
+    """Lịch sử mới nhất trước; since_id => `limit` bản ghi kế tiếp sau since_id
+    (id nhỏ nhất trước khi cắt, xem get_history_json_for_user)."""
+    conn = get_conn()
+    c = conn.cursor()
+    if since_id is None:
+        c.execute("SELECT id, request_json, response_json, created_at FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit))
+        rows = c.fetchall()
+    else:
+        c.execute("SELECT id, request_json, response_json, created_at FROM history WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (user_id, since_id, limit))
+        rows = c.fetchall()[::-1]
     out = []
     for r in rows:
         item = dict(r)
+        response, version = _reconstruct(conn, item["id"], item["response_json"])
         out.append({
             "id": item["id"],
+            "version": version,
             "request": json.loads(item["request_json"]),
-            "response": json.loads(item["response_json"]),
+            "response": response,
             "created_at": item["created_at"]
         })
-    return out
\ No newline at end of file
+    conn.close()
+    return out
+
+# Ghép sẵn object JSON của từng item ngay trong SQLite từ các cột đã lưu dạng
+# JSON text => không json.loads rồi lại dumps ở Python
+# (bản ghi chưa sửa luôn ở version 1)
+_HISTORY_ITEM_SQL = """'{"id":' || id || ',"version":1,"request":' || request_json || ',"response":' || response_json || ',"created_at":' || json_quote(created_at) || '}'"""
+# 1 nếu bản ghi đã có version sau bản gốc (hiếm): item đó được dựng lại ở Python
+_HISTORY_VERSIONED_SQL = "EXISTS (SELECT 1 FROM history_versions WHERE history_id = history.id)"
+
+def _item_fragments(conn: sqlite3.Connection, rows) -> List[str]:
+    """rows: (id, item JSON, versioned) -> JSON từng item, thay item đã sửa bằng bản mới nhất."""
+    versioned = _versioned_items(conn, [r[0] for r in rows if r[2]]) if any(r[2] for r in rows) else {}
+    return [versioned.get(r[0], r[1]) for r in rows]
+
+def get_history_json_for_user(user_id: int, limit: int = 100, since_id: Optional[int] = None) -> bytes:
+    """Như get_history_for_user nhưng trả thẳng body JSON {"history": [...]}.
+
+    Với since_id (delta sync): lấy `limit` bản ghi ngay sau since_id (không
+    phải `limit` bản mới nhất - sẽ bỏ sót các bản ở giữa), vẫn xếp mới nhất
+    trước; "has_more": true => gọi lại với since_id = id lớn nhất vừa nhận.
+    """
+    conn = get_conn()
+    conn.row_factory = None
+    c = conn.cursor()
+    columns = f"id, {_HISTORY_ITEM_SQL}, {_HISTORY_VERSIONED_SQL}"
+    if since_id is None:
+        c.execute(f"SELECT {columns} FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?", (user_id, limit))
+        rows = c.fetchall()
+        tail = ""
+    else:
+        c.execute(f"SELECT {columns} FROM history WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", (user_id, since_id, limit + 1))
+        rows = c.fetchall()
+        tail = ',"has_more":' + ("true" if len(rows) > limit else "false")
+        rows = rows[:limit][::-1]
+    items = _item_fragments(conn, rows)
+    conn.close()
+    return ('{"history":[' + ",".join(items) + "]" + tail + "}").encode("utf-8")
+
+def iter_history_ndjson(user_id: int, after_id: int = 0, batch_size: int = 500) -> Iterator[bytes]:
+    """Xuất toàn bộ history của user dạng NDJSON (id tăng dần), từng lô.
+
+    Mỗi lô là một truy vấn ngắn `id > last_id LIMIT batch_size` chứ không giữ
+    một cursor mở suốt quá trình export: SQLite giữ khoá SHARED khi cursor còn
+    mở và sẽ chặn ghi. Bộ nhớ không phụ thuộc số bản ghi; tiếp tục từ id cuối
+    cùng đã nhận bằng after_id.
+    """
+    last_id = after_id
+    while True:
+        conn = get_conn()
+        conn.row_factory = None
+        try:
+            c = conn.execute(f"SELECT id, {_HISTORY_ITEM_SQL}, {_HISTORY_VERSIONED_SQL} FROM history "
+                             "WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                             (user_id, last_id, batch_size))
+            rows = c.fetchmany(batch_size)
+            items = _item_fragments(conn, rows)
+        finally:
+            conn.close()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield ("\n".join(items) + "\n").encode("utf-8")
+        if len(rows) < batch_size:
+            return
@@ -0,0 +1,112 @@
+# degrade.py - chế độ giảm tải cho /generate khi model quá tải
+#
+# Hàng chờ model dài hơn DEGRADE_QUEUE_DEPTH hoặc p95 latency gần đây vượt
+# DEGRADE_LATENCY_SLO => /generate trả ngay itinerary dựng từ interests/pace
+# (itinerary_builder) kèm "degraded": true. Nếu DEGRADE_UPGRADE=1, bản ghi
+# history đó được sinh lại bằng model ở nền khi hàng chờ rảnh và thay thế tại chỗ.
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from collections import deque
+from datetime import date
+from typing import Optional
+
+from db import upgrade_history_response
+from generation import OLLAMA_URLS, generate_itinerary, scheduler
+from metrics import metrics
+
+DEGRADE_QUEUE_DEPTH = int(os.environ.get("DEGRADE_QUEUE_DEPTH", "8"))  # số request chờ slot model
+DEGRADE_LATENCY_SLO = float(os.environ.get("DEGRADE_LATENCY_SLO", "20"))  # giây, p95 của /generate
+DEGRADE_WINDOW_SECONDS = 60  # chỉ xét latency trong cửa sổ này
+DEGRADE_PROBE_PERCENT = 10  # khi degraded vì latency, vẫn cho % request này tới model để đo lại
+DEGRADE_UPGRADE = os.environ.get("DEGRADE_UPGRADE", "1") == "1"
+UPGRADE_QUEUE_SIZE = int(os.environ.get("DEGRADE_UPGRADE_QUEUE", "100"))
+
+logger = logging.getLogger("trip.degrade")
+
+_lock = threading.Lock()
+_recent = deque(maxlen=200)  # (thời điểm, giây)
+
+
+def record_latency(seconds: float):
+    with _lock:
+        _recent.append((time.monotonic(), seconds))
+
+
+def _recent_p95() -> Optional[float]:
+    cutoff = time.monotonic() - DEGRADE_WINDOW_SECONDS
+    with _lock:
+        values = sorted(s for t, s in _recent if t >= cutoff)
+    if len(values) < 5:
+        return None
+    return values[min(len(values) - 1, int(0.95 * len(values)))]
+
+
+def overload_reason() -> Optional[str]:
+    """"queue" | "latency" nếu nên trả bản degraded, None nếu bình thường."""
+    if not OLLAMA_URLS:
+        return None  # không có LLM: builder vốn đã trả ngay
+    if scheduler.pending() >= DEGRADE_QUEUE_DEPTH:
+        return "queue"
+    p95 = _recent_p95()
+    if p95 is not None and p95 > DEGRADE_LATENCY_SLO and random.random() * 100 >= DEGRADE_PROBE_PERCENT:
+        return "latency"
+    return None
+
+
+class Upgrader:
+    """Một thread nền sinh lại các itinerary degraded khi hàng chờ model trống."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=UPGRADE_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None and DEGRADE_UPGRADE and OLLAMA_URLS:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="degrade-upgrader", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, user_id: int, entry_id: int, payload: dict, start: date, end: date):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait((user_id, entry_id, payload, start, end))
+        except queue.Full:
+            metrics.incr("generate.upgrade_dropped")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # nhường slot model cho request thật
+            while scheduler.pending() > 0 and not self._stop.wait(1):
+                pass
+            if self._stop.is_set():
+                return
+            user_id, entry_id, payload, start, end = job
+            started = time.perf_counter()
+            try:
+                result = generate_itinerary(payload, start, end)
+            except Exception as e:
+                metrics.incr("generate.upgrade_failed")
+                logger.warning("upgrade of history %s failed: %s", entry_id, e)
+                continue
+            record_latency(time.perf_counter() - started)
+            if upgrade_history_response(user_id, entry_id, result):
+                metrics.incr("generate.upgraded")
+
+
+upgrader = Upgrader()
@@ -0,0 +1,50 @@
+# fastresponse.py - JSON response bằng orjson + nén gzip/brotli theo Accept-Encoding
+import os
+
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli-asgi (requirements.txt); thiếu thì chỉ gzip
+    BrotliMiddleware = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))  # bytes
+# Stream từng ngày cần tới client ngay, không để bộ nén giữ lại
+COMPRESS_EXCLUDE_PATHS = ("/generate/stream",)
+
+
+class OrjsonResponse(JSONResponse):
+    """Serialize thẳng dict/list ra bytes bằng orjson.
+
+    Trả instance này trực tiếp từ endpoint để FastAPI bỏ qua bước
+    jsonable_encoder; nội dung chỉ được chứa kiểu JSON thuần.
+    Không dùng fastapi.responses.ORJSONResponse: FastAPI bản mới (requirements
+    không ghim version) đánh dấu class đó deprecated và cảnh báo mỗi lần tạo
+    response; các endpoint ở đây trả dict không có response_model nên không
+    hưởng đường serialize bằng Pydantic mà FastAPI khuyên dùng thay thế.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE, exclude_paths=COMPRESS_EXCLUDE_PATHS):
+        self.app = app
+        self.exclude_paths = exclude_paths
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, minimum_size=minimum_size, gzip_fallback=True)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self.exclude_paths:
+            await self.compressed(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+def install_compression(app):
+    app.add_middleware(CompressionMiddleware)
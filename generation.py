@@ -0,0 +1,298 @@
+# generation.py - lớp sinh itinerary: gọi model (Ollama) hoặc builder mock
+#
+# OLLAMA_URL không đặt => dùng itinerary_builder (trả ngay, không cần LLM).
+# Mỗi lần sinh giữ một slot trong giới hạn MAX_CONCURRENT_GENERATIONS (request
+# ngắn được ưu tiên, xem scheduler.py) và có thể bị huỷ giữa chừng (client ngắt
+# kết nối / quá deadline): khi đó request tới model bị đóng để model dừng sinh
+# và slot được trả lại ngay.
+# Request đơn giản chạy trên model nhỏ (OLLAMA_MODEL_SMALL) trước, output không
+# hợp lệ thì chạy lại trên model lớn (OLLAMA_MODEL). Có nhiều backend thì
+# xoay vòng và (HEDGE_ENABLED=1) hedge request chậm, xem hedging.py.
+# on_day (dùng cho /generate/stream): từng ngày được tách khỏi token stream của
+# model và gửi đi ngay khi hợp lệ, xem DayStream.
+import os
+import re
+import json
+import time
+import itertools
+import threading
+from datetime import date
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from cost_model import cost_model
+from hedging import HedgeBudget, hedged_call
+from itinerary_builder import SLOTS, alternative_slot, build_days
+from itinerary_patch import current_slot
+from metrics import metrics
+from model_lifecycle import OLLAMA_KEEP_ALIVE, lifecycle, record_load
+from prompt_template import build_prompt, build_slot_prompt, parse_model_output
+from scheduler import SjfScheduler
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL")  # vd http://localhost:11434; nhiều backend: cách nhau dấu phẩy
+OLLAMA_URLS = [u.strip().rstrip("/") for u in (OLLAMA_URL or "").split(",") if u.strip()]
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "trip-scheduler")
+# Tier nhỏ (vd trip-scheduler-small.modelfile) cho request đơn giản; để trống = chỉ dùng OLLAMA_MODEL
+OLLAMA_MODEL_SMALL = os.environ.get("OLLAMA_MODEL_SMALL", "")
+SMALL_TIER_MAX_TOKENS = float(os.environ.get("SMALL_TIER_MAX_TOKENS", "400"))  # ~ 4 ngày, ít interest
+SLOT_COST_TOKENS = 40.0  # cost ước lượng khi sinh lại một slot
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("MAX_CONCURRENT_GENERATIONS", "4"))
+# Hedging (cần >= 2 backend): chưa có token đầu sau p(HEDGE_PERCENTILE) của
+# thời gian ra token đầu thì gửi thêm tới backend kế tiếp
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+HEDGE_BUDGET_PERCENT = float(os.environ.get("HEDGE_BUDGET_PERCENT", "5"))  # tối đa ~% request được hedge
+HEDGE_DEFAULT_DELAY = 2.0  # giây, khi chưa có mẫu
+HEDGE_MIN_DELAY = 0.2
+
+scheduler = SjfScheduler(MAX_CONCURRENT_GENERATIONS)
+hedge_budget = HedgeBudget(HEDGE_BUDGET_PERCENT)
+_next_backend = itertools.count()
+_DAYS_ARRAY = re.compile(r'"days"\s*:\s*\[')
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # "disconnect" | "deadline"
+
+
+def check_cancel(cancel: Optional[threading.Event], deadline: Optional[float]):
+    """deadline tính theo time.monotonic()."""
+    if cancel is not None and cancel.is_set():
+        raise GenerationCancelled("disconnect")
+    if deadline is not None and time.monotonic() >= deadline:
+        raise GenerationCancelled("deadline")
+
+
+def generate_itinerary(payload: dict, start: date, end: date,
+                       cancel: Optional[threading.Event] = None,
+                       deadline: Optional[float] = None,
+                       on_day: Optional[Callable[[dict], None]] = None) -> dict:
+    """Sinh itinerary {"days": [...]}; raise GenerationCancelled nếu bị huỷ.
+
+    on_day(day): gọi với từng ngày đã hợp lệ ngay khi có. Đã gửi ngày nào thì
+    không chạy lại trên model lớn được nữa: output lỗi sau đó raise ValueError.
+    """
+    check_cancel(cancel, deadline)
+    cost = cost_model.estimate_request(start, end, payload["interests"], payload["pace"])
+    waited = scheduler.acquire(cost, lambda: check_cancel(cancel, deadline))
+    metrics.observe("generate.queue_wait", waited)
+    started = time.perf_counter()
+    try:
+        check_cancel(cancel, deadline)
+        if OLLAMA_URLS:
+            days = DayStream(on_day, (end - start).days + 1) if on_day is not None else None
+            result = _generate_tiered(build_prompt(payload), cost, lambda r: validate_itinerary(r, start, end),
+                                      cancel, deadline, days)
+            if days is not None:
+                days.finish(result)
+            return result
+        result = {"days": build_days(start, end, payload["interests"], payload["pace"])}
+        if on_day is not None:
+            for day in result["days"]:
+                on_day(day)
+        return result
+    finally:
+        scheduler.release()
+        metrics.observe("generate.model", time.perf_counter() - started)
+
+
+def generate_slot(payload: dict, day: dict, slot: str, hint: Optional[str] = None,
+                  cancel: Optional[threading.Event] = None,
+                  deadline: Optional[float] = None) -> dict:
+    """Sinh lại một slot {"time", "title", "explain"} của một ngày đã có
+    (prompt ngắn, chỉ tốn token của một slot)."""
+    check_cancel(cancel, deadline)
+    waited = scheduler.acquire(SLOT_COST_TOKENS, lambda: check_cancel(cancel, deadline))
+    metrics.observe("generate.queue_wait", waited)
+    started = time.perf_counter()
+    try:
+        check_cancel(cancel, deadline)
+        if OLLAMA_URLS:
+            return _generate_tiered(build_slot_prompt(payload, day, slot, hint), SLOT_COST_TOKENS, validate_slot,
+                                    cancel, deadline)
+        return alternative_slot(payload["interests"], payload["pace"], slot, current_slot(day, slot).get("title"))
+    finally:
+        scheduler.release()
+        metrics.observe("generate.slot", time.perf_counter() - started)
+
+
+def configured_models() -> List[str]:
+    return [m for m in (OLLAMA_MODEL_SMALL, OLLAMA_MODEL) if m]
+
+
+def model_tiers(cost: float) -> List[Tuple[str, str]]:
+    """Các (tier, model) sẽ thử theo thứ tự: request đơn giản thử model nhỏ
+    trước, output không hợp lệ thì lên model lớn."""
+    if OLLAMA_MODEL_SMALL and cost <= SMALL_TIER_MAX_TOKENS:
+        return [("small", OLLAMA_MODEL_SMALL), ("large", OLLAMA_MODEL)]
+    return [("large", OLLAMA_MODEL)]
+
+
+def validate_itinerary(result, start: date, end: date):
+    """raise ValueError nếu output của model không dùng được."""
+    if not isinstance(result, dict) or not isinstance(result.get("days"), list):
+        raise ValueError("Model returned invalid itinerary JSON")
+    days = result["days"]
+    if len(days) != (end - start).days + 1:
+        raise ValueError(f"Model returned {len(days)} days, expected {(end - start).days + 1}")
+    for day in days:
+        validate_day(day)
+
+
+def validate_day(day):
+    if not isinstance(day, dict) or not all(isinstance(day.get(slot), dict) and day[slot].get("title") for slot in SLOTS):
+        raise ValueError("Model returned a day with missing slots")
+
+
+def validate_slot(result):
+    if not isinstance(result, dict) or not isinstance(result.get("title"), str) or not result["title"].strip():
+        raise ValueError("Model returned an invalid slot")
+
+
+class DayStream:
+    """Tách từng ngày khỏi output JSON {"days": [{...}, ...]} khi model còn
+    đang sinh: mỗi object trong mảng "days" vừa đóng ngoặc được kiểm tra rồi
+    chuyển cho on_day."""
+
+    def __init__(self, on_day: Callable[[dict], None], expected: int):
+        self.on_day = on_day
+        self.expected = expected
+        self.sent = 0
+        self.restart()
+
+    def restart(self):
+        """Bắt đầu đọc output của một lần gọi model mới."""
+        self._buf = ""
+        self._pos = None  # vị trí đang quét trong mảng "days" (None = chưa thấy)
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escape = False
+        self._closed = False
+
+    def feed(self, text: str):
+        """raise ValueError nếu một ngày không hợp lệ hoặc thừa ngày."""
+        if self._closed:
+            return
+        self._buf += text
+        if self._pos is None:
+            m = _DAYS_ARRAY.search(self._buf)
+            if m is None:
+                return
+            self._pos = m.end()
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:  # hết mảng "days"
+                    self._closed = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(json.loads(buf[self._start:i + 1]))
+            i += 1
+        self._pos = i
+
+    def _emit(self, day):
+        validate_day(day)
+        if self.sent >= self.expected:
+            raise ValueError(f"Model returned more than {self.expected} days")
+        self.on_day(day)
+        self.sent += 1
+
+    def finish(self, result: dict):
+        """Itinerary đã hợp lệ: gửi nốt các ngày chưa tách được (vd output
+        không đúng dạng {"days": [...]} nhưng parse_model_output vẫn đọc được)."""
+        for day in result["days"][self.sent:]:
+            self.on_day(day)
+            self.sent += 1
+
+
+def _generate_tiered(prompt: str, cost: float, validate, cancel, deadline,
+                     days: Optional[DayStream] = None) -> dict:
+    tiers = model_tiers(cost)
+    for i, (tier, model) in enumerate(tiers):
+        started = time.perf_counter()
+        try:
+            result = _call_model(prompt, model, cancel, deadline, days)
+            validate(result)
+        except ValueError:
+            metrics.incr(f"generate.tier.{tier}.invalid")
+            # ngày đã tới client thì không thay bằng output của model khác được
+            if i == len(tiers) - 1 or (days is not None and days.sent):
+                raise
+            metrics.incr("generate.tier.fallback")
+            continue
+        finally:
+            metrics.observe(f"generate.tier.{tier}", time.perf_counter() - started)
+        metrics.incr(f"generate.tier.{tier}.ok")
+        return result
+
+
+def hedge_delay(model: str) -> float:
+    observed = metrics.percentile(f"generate.first_token.{model}", HEDGE_PERCENTILE)
+    return max(HEDGE_MIN_DELAY, observed if observed is not None else HEDGE_DEFAULT_DELAY)
+
+
+def _call_model(prompt: str, model: str, cancel, deadline, days: Optional[DayStream] = None):
+    # xoay vòng backend chính để chia tải
+    first = next(_next_backend) % len(OLLAMA_URLS)
+    urls = OLLAMA_URLS[first:] + OLLAMA_URLS[:first]
+    if days is not None:
+        # stream: chỉ một lần gọi được đẩy token ra client nên không hedge
+        days.restart()
+        return _ollama_generate(prompt, model, urls[0], cancel, deadline, on_text=days.feed)
+    if not HEDGE_ENABLED or len(urls) < 2:
+        return _ollama_generate(prompt, model, urls[0], cancel, deadline)
+    return hedged_call(lambda url, stop, first_token: _ollama_generate(prompt, model, url, stop, deadline, first_token),
+                       urls, hedge_delay(model), hedge_budget, lambda: check_cancel(cancel, deadline))
+
+
+def _ollama_generate(prompt: str, model: str, url: str, cancel, deadline,
+                     first_token: Optional[threading.Event] = None,
+                     on_text: Optional[Callable[[str], None]] = None) -> dict:
+    timeout = None
+    if deadline is not None:
+        timeout = max(0.1, deadline - time.monotonic())
+    body = {"model": model, "prompt": prompt, "stream": True, "format": "json",
+            "keep_alive": f"{OLLAMA_KEEP_ALIVE}s"}
+    lifecycle.touch(url, model)
+    started = time.perf_counter()
+    chunks = []
+    # stream=True để kiểm tra huỷ sau mỗi token; thoát khỏi `with` sẽ đóng kết
+    # nối và Ollama dừng sinh cho request đó
+    with requests.post(f"{url}/api/generate", json=body, stream=True, timeout=(5, timeout)) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            check_cancel(cancel, deadline)
+            if not line:
+                continue
+            obj = json.loads(line)
+            if not chunks:
+                metrics.observe(f"generate.first_token.{model}", time.perf_counter() - started)
+                if first_token is not None:
+                    first_token.set()
+            chunks.append(obj.get("response", ""))
+            if on_text is not None:
+                on_text(chunks[-1])
+            if obj.get("done"):
+                record_load(model, obj.get("load_duration", 0) / 1e9, "request")
+                break
+    return parse_model_output("".join(chunks))
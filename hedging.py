@@ -0,0 +1,100 @@
+# hedging.py - gửi request dự phòng (hedge) tới backend thứ hai khi backend
+# chính chậm ra token đầu tiên; lấy kết quả về trước, huỷ cái còn lại.
+#
+# Số hedge bị giới hạn bởi HedgeBudget (token bucket: mỗi request góp
+# percent/100 token, mỗi hedge tốn 1) để tải thêm không quá vài % traffic.
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from metrics import metrics
+
+
+class HedgeBudget:
+    def __init__(self, percent: float, burst: float = 3.0):
+        self._lock = threading.Lock()
+        self._rate = percent / 100.0
+        self._burst = burst
+        self._tokens = burst
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self._burst, self._tokens + self._rate)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class _SignalEvent(threading.Event):
+    """Event báo thêm cho vòng chờ của hedged_call khi được set."""
+
+    def __init__(self, changed: threading.Event):
+        super().__init__()
+        self._changed = changed
+
+    def set(self):
+        super().set()
+        self._changed.set()
+
+
+class _Attempt:
+    """Một lần gọi fn(target, stop, first_token) chạy trong thread riêng."""
+
+    def __init__(self, fn, target, changed: threading.Event):
+        self.target = target
+        self.stop = threading.Event()
+        self.first_token = _SignalEvent(changed)
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self._changed = changed
+        threading.Thread(target=self._run, args=(fn,), daemon=True).start()
+
+    def _run(self, fn):
+        try:
+            self.result = fn(self.target, self.stop, self.first_token)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done.set()
+            self._changed.set()
+
+
+def hedged_call(fn: Callable[[Any, threading.Event, threading.Event], Any], targets: List[Any],
+                delay: float, budget: HedgeBudget, check: Callable[[], None]):
+    """Gọi fn trên targets[0]; sau `delay` giây chưa có token đầu tiên thì gửi
+    thêm tới targets[1] (nếu budget cho phép). fn phải dừng sớm khi `stop` được
+    set và set `first_token` khi nhận được token đầu. `check()` có thể raise để
+    huỷ toàn bộ (client ngắt kết nối / quá deadline)."""
+    budget.record_request()
+    changed = threading.Event()
+    attempts = [_Attempt(fn, targets[0], changed)]
+    hedge_at = time.monotonic() + delay
+    try:
+        while True:
+            changed.clear()
+            check()
+            for attempt in attempts:
+                if attempt.done.is_set() and attempt.error is None:
+                    if attempt is not attempts[0]:
+                        metrics.incr("generate.hedge.won")
+                    return attempt.result
+            if all(a.done.is_set() for a in attempts):
+                raise attempts[0].error
+            primary = attempts[0]
+            if (len(attempts) == 1 and len(targets) > 1 and time.monotonic() >= hedge_at
+                    and not primary.first_token.is_set()):
+                if budget.try_spend():
+                    metrics.incr("generate.hedge.sent")
+                    attempts.append(_Attempt(fn, targets[1], changed))
+                else:
+                    metrics.incr("generate.hedge.over_budget")
+                hedge_at = float("inf")
+            changed.wait(min(0.1, max(0.0, hedge_at - time.monotonic())) or 0.1)
+    finally:
+        for attempt in attempts:
+            attempt.stop.set()
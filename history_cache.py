@@ -0,0 +1,35 @@
+# history_cache.py - cache lịch sử phía Streamlit (1 file JSON / user)
+import os
+import json
+import hashlib
+import tempfile
+from typing import Dict, List, Optional
+
+CACHE_DIR = os.environ.get("HISTORY_CACHE_DIR", os.path.join(".cache", "history"))
+
+
+def _path(api_url: str, user_id) -> str:
+    name = hashlib.sha1(f"{api_url}|{user_id}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+def load(api_url: str, user_id) -> Optional[Dict]:
+    """{"etag": str | None, "items": [...]} hoặc None nếu chưa có cache."""
+    try:
+        with open(_path(api_url, user_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(api_url: str, user_id, items: List[Dict], etag: Optional[str] = None):
+    """Ghi cache (atomic). etag=None khi danh sách đã bị sửa cục bộ."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "items": items}, f, ensure_ascii=False)
+        os.replace(tmp, _path(api_url, user_id))
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,153 @@
+# idempotency.py - header Idempotency-Key cho các POST tốn kém (/generate, /register)
+#
+# Lần đầu: giữ key trong bảng idempotency_keys rồi xử lý bình thường; response
+# 2xx được lưu (nén zlib) trong IDEMPOTENCY_TTL giây. Lần thử lại cùng key:
+#   - đã xong      -> trả lại response đã lưu (header Idempotent-Replayed: true)
+#   - đang xử lý   -> chờ request gốc xong rồi trả cùng kết quả
+#   - request gốc lỗi -> key được bỏ, lần thử lại xử lý từ đầu
+# Response stream (StreamingResponse) được ghi lại khi gửi xong; key được giữ
+# tới lúc đó.
+# Cùng key nhưng body khác -> 422.
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import orjson
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from auth import SECRET_KEY
+from metrics import metrics
+from profiler import run_in_threadpool
+from db import claim_idempotency_key, finish_idempotency_key, release_idempotency_key
+
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))  # giây
+# request đang xử lý giữ key tối đa chừng này (worker chết thì key tự hết hạn)
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "300"))
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "200"))  # chờ request gốc tối đa
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.2
+
+# request đang chạy trong process này: key_hash -> Future (xong khi request gốc xong)
+_inflight: Dict[bytes, asyncio.Future] = {}
+
+
+def key_digest(scope: str, key: str) -> bytes:
+    return hashlib.sha256(f"{scope}\0{key}".encode("utf-8")).digest()
+
+
+def fingerprint(body: dict) -> bytes:
+    """HMAC của body: so khớp lần thử lại mà không lưu body (có thể chứa mật khẩu)."""
+    return hmac.new(SECRET_KEY.encode(), orjson.dumps(body, option=orjson.OPT_SORT_KEYS), hashlib.sha256).digest()
+
+
+async def _replay_raw(stored: bytes) -> Response:
+    return Response(content=stored, media_type="application/json")
+
+
+async def run_idempotent(scope: str, key: str, body: dict,
+                         compute: Callable[[], Awaitable[Response]],
+                         save: Optional[Callable[[Response], bytes]] = None,
+                         replay: Optional[Callable[[bytes], Awaitable[Response]]] = None,
+                         save_stream: Optional[Callable[[bytes], Optional[bytes]]] = None) -> Response:
+    """Chạy `compute()` đúng một lần cho (scope, key).
+
+    save(response) -> bytes cần lưu (mặc định: body response);
+    save_stream(body) -> như save cho StreamingResponse, None = không lưu (vd
+    stream kết thúc bằng lỗi); mặc định lưu cả body;
+    replay(bytes) -> response trả cho lần thử lại (mặc định: trả nguyên JSON).
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    key_hash = key_digest(scope, key)
+    fp = fingerprint(body)
+    give_up_at = time.monotonic() + IDEMPOTENCY_WAIT
+    attached = False
+
+    while True:
+        now = int(time.time())
+        row = await run_in_threadpool(claim_idempotency_key, key_hash, fp, now, now + IDEMPOTENCY_LOCK_SECONDS)
+        if row is None:
+            return await _run_owner(key_hash, compute, save or (lambda r: r.body), save_stream or (lambda b: b))
+        if not hmac.compare_digest(row["fingerprint"], fp):
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if row["status"] is not None:
+            metrics.incr("idempotency.replayed")
+            response = await (replay or _replay_raw)(zlib.decompress(row["response"]))
+            response.status_code = row["status"]
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        # request gốc đang chạy: chờ nó xong (cùng process thì chờ Future, khác process thì poll DB)
+        if not attached:
+            metrics.incr("idempotency.attached")
+            attached = True
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        fut = _inflight.get(key_hash)
+        if fut is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(POLL_INTERVAL)
+        # vòng lại: request gốc xong -> replay; lỗi (key đã bỏ) -> tự xử lý
+
+
+async def _run_owner(key_hash: bytes, compute, save, save_stream) -> Response:
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key_hash] = fut
+    stored = False
+    streaming = False
+    try:
+        response = await compute()
+        if isinstance(response, StreamingResponse) and 200 <= response.status_code < 300:
+            # kết quả chỉ biết khi stream gửi xong: giữ key tới lúc đó
+            response.body_iterator = _record_stream(key_hash, fut, response.body_iterator,
+                                                    response.status_code, response.charset, save_stream)
+            streaming = True
+        elif 200 <= response.status_code < 300:
+            await _store(key_hash, response.status_code, save(response))
+            stored = True
+        return response
+    finally:
+        if not streaming:
+            await _settle(key_hash, fut, stored)
+
+
+async def _record_stream(key_hash: bytes, fut, body: AsyncIterator, status: int, charset: str,
+                         save_stream) -> AsyncIterator[bytes]:
+    chunks = []
+    stored = False
+    try:
+        async for chunk in body:
+            chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode(charset))
+            yield chunk
+        data = save_stream(b"".join(chunks))
+        if data is not None:
+            await _store(key_hash, status, data)
+            stored = True
+    finally:
+        await _settle(key_hash, fut, stored)
+
+
+async def _store(key_hash: bytes, status: int, data: bytes):
+    await run_in_threadpool(finish_idempotency_key, key_hash, status,
+                            zlib.compress(data), int(time.time()) + IDEMPOTENCY_TTL)
+
+
+async def _settle(key_hash: bytes, fut, stored: bool):
+    """Request gốc xong: lỗi thì bỏ key, báo cho các request đang chờ."""
+    try:
+        if not stored:
+            # shield: stream bị huỷ giữa chừng (client ngắt) vẫn phải bỏ key
+            await asyncio.shield(run_in_threadpool(release_idempotency_key, key_hash))
+    finally:
+        _inflight.pop(key_hash, None)
+        fut.set_result(None)
@@ -0,0 +1,106 @@
+# itinerary_builder.py - dựng danh sách ngày (mock, không cần LLM) từ khoảng ngày
+#
+# Dùng chung cho main.py, api.py và server.py. Nội dung slot chỉ phụ thuộc
+# (interests, pace) nên được dựng sẵn một lần và cache; mỗi ngày chỉ còn tạo
+# dict {"date": ..., "morning": <template>, ...}.
+# Các dict slot được dùng chung giữa các ngày: chỉ đọc / serialize, không sửa.
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+SLOTS = ("morning", "afternoon", "evening")
+
+PACE_TIMES = {
+    "relaxed": ("09:30", "14:00", "19:00"),
+    "normal": ("08:00", "13:00", "18:00"),
+    "tight": ("07:00", "12:00", "17:30"),
+}
+
+# interest -> (title, explain) cho morning / afternoon / evening
+ACTIVITIES = {
+    "food": (
+        ("Local breakfast market", "Taste street food favourites."),
+        ("Cooking class", "Learn a signature regional dish."),
+        ("Food street tour", "Try local cuisine."),
+    ),
+    "museums": (
+        ("History museum", "Enjoy history and culture."),
+        ("Art gallery", "See local and contemporary artists."),
+        ("Heritage walk", "Old quarter landmarks at sunset."),
+    ),
+    "nature": (
+        ("Morning walk", "Explore parks and local streets."),
+        ("Scenic viewpoint", "Short hike with panoramic views."),
+        ("Riverside stroll", "Relax by the water after dinner."),
+    ),
+    "nightlife": (
+        ("Late brunch", "Slow start before a long night."),
+        ("Rooftop café", "Rest and plan the evening."),
+        ("Dinner & Nightlife", "Bars and live music."),
+    ),
+}
+
+DEFAULT_ACTIVITIES = (
+    ("Morning walk", "Explore local streets."),
+    ("Museum visit", "Enjoy history and culture."),
+    ("Dinner & Nightlife", "Try local cuisine."),
+)
+
+
+def normalize(interests: Iterable[str], pace: str) -> Tuple[Tuple[str, ...], str]:
+    """Khoá cache: interests (lowercase, bỏ trùng, giữ thứ tự) + pace hợp lệ."""
+    seen = []
+    for interest in interests:
+        key = interest.strip().lower()
+        if key in ACTIVITIES and key not in seen:
+            seen.append(key)
+    pace = pace.strip().lower() if pace else "normal"
+    return tuple(seen), (pace if pace in PACE_TIMES else "normal")
+
+
+@lru_cache(maxsize=512)
+def slot_templates(interests: Tuple[str, ...], pace: str) -> Tuple[Dict, ...]:
+    """Các mẫu ngày (3 slot) cho (interests, pace); ngày thứ i dùng mẫu i % len.
+
+    Mỗi slot của ngày lấy từ một interest khác nhau, xoay vòng theo ngày để
+    chuyến dài không lặp lại y hệt.
+    """
+    times = PACE_TIMES[pace]
+    sources = [ACTIVITIES[i] for i in interests] or [DEFAULT_ACTIVITIES]
+    templates = []
+    for offset in range(len(sources)):
+        day = {}
+        for s, slot in enumerate(SLOTS):
+            title, explain = sources[(offset + s) % len(sources)][s]
+            day[slot] = {"time": times[s], "title": title, "explain": explain}
+        templates.append(day)
+    return tuple(templates)
+
+
+def iter_days(start: date, end: date, interests: Sequence[str], pace: str) -> Iterator[Dict]:
+    templates = slot_templates(*normalize(interests, pace))
+    k = len(templates)
+    first = start.toordinal()
+    for i in range(end.toordinal() - first + 1):
+        yield {"date": date.fromordinal(first + i).isoformat(), **templates[i % k]}
+
+
+def build_days(start: date, end: date, interests: Sequence[str], pace: str) -> List[Dict]:
+    return list(iter_days(start, end, interests, pace))
+
+
+def build_batch(specs: Sequence[Tuple[date, date, Sequence[str], str]]) -> List[Dict]:
+    """Nhiều itinerary một lúc; các request cùng (interests, pace) dùng chung mẫu."""
+    return [{"days": build_days(start, end, interests, pace)} for start, end, interests, pace in specs]
+
+
+def alternative_slot(interests: Sequence[str], pace: str, slot: str, exclude_title: Optional[str] = None) -> Dict:
+    """Một hoạt động khác cho `slot` (dùng khi sinh lại 1 slot không có LLM):
+    ưu tiên các interest của request, rồi tới các interest còn lại."""
+    interests, pace = normalize(interests, pace)
+    s = SLOTS.index(slot)
+    candidates = [ACTIVITIES[i][s] for i in interests]
+    candidates += [acts[s] for key, acts in ACTIVITIES.items() if key not in interests]
+    candidates.append(DEFAULT_ACTIVITIES[s])
+    title, explain = next((c for c in candidates if c[0] != exclude_title), candidates[0])
+    return {"time": PACE_TIMES[pace][s], "title": title, "explain": explain}
@@ -0,0 +1,122 @@
+# itinerary_patch.py - JSON Patch (RFC 6902, tập con add/replace/remove) cho itinerary
+#
+# Sửa một slot của itinerary đã lưu chỉ ghi một patch nhỏ
+#   [{"op": "replace", "path": "/days/2/evening", "value": {...}}]
+# thay vì lưu lại cả itinerary; khi đọc, patch được áp lên bản gốc theo thứ tự.
+# diff_itinerary tạo patch giữa hai bản (lưu revision mới dưới dạng delta).
+import copy
+from typing import Any, Dict, List
+
+from itinerary_builder import SLOTS
+
+_MISSING = object()
+
+
+def slot_path(day_index: int, slot: str) -> str:
+    return f"/days/{day_index}/{slot}"
+
+
+def slot_patch(day_index: int, slot: str, value: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"op": "replace", "path": slot_path(day_index, slot), "value": value}]
+
+
+def _escape(key: str) -> str:
+    """Một phần của JSON Pointer (RFC 6901): "~" -> "~0", "/" -> "~1"."""
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _split(path: str) -> List[str]:
+    if not path.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer: {path!r}")
+    return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+
+
+def _container(doc, parts):
+    for part in parts:
+        doc = doc[int(part)] if isinstance(doc, list) else doc[part]
+    return doc
+
+
+def apply_patch(doc: Any, ops: List[Dict[str, Any]], in_place: bool = False) -> Any:
+    """Áp các op lên doc; raise ValueError nếu path không tồn tại."""
+    if not in_place:
+        doc = copy.deepcopy(doc)
+    for op in ops:
+        parts = _split(op["path"])
+        try:
+            parent = _container(doc, parts[:-1])
+            key = parts[-1]
+            if isinstance(parent, list):
+                index = len(parent) if key == "-" else int(key)
+                if op["op"] == "add":
+                    parent.insert(index, op["value"])
+                elif op["op"] == "replace":
+                    parent[index] = op["value"]
+                elif op["op"] == "remove":
+                    del parent[index]
+                else:
+                    raise ValueError(f"Unsupported op {op['op']!r}")
+            else:
+                if op["op"] in ("add", "replace"):
+                    if op["op"] == "replace" and key not in parent:
+                        raise KeyError(key)
+                    parent[key] = op["value"]
+                elif op["op"] == "remove":
+                    del parent[key]
+                else:
+                    raise ValueError(f"Unsupported op {op['op']!r}")
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"Patch path {op['path']!r} not found") from e
+    return doc
+
+
+def check_slot(itinerary: Dict[str, Any], day_index: int, slot: str):
+    """raise ValueError nếu itinerary không có days[day_index][slot]."""
+    if slot not in SLOTS:
+        raise ValueError(f"slot must be one of {', '.join(SLOTS)}")
+    days = itinerary.get("days") or []
+    if not 0 <= day_index < len(days):
+        raise ValueError(f"day_index must be between 0 and {len(days) - 1}")
+    if not isinstance(days[day_index], dict):
+        raise ValueError(f"day {day_index} has no slots")
+
+
+def current_slot(day: Dict[str, Any], slot: str) -> Dict[str, Any]:
+    """Slot dạng {"time", "title", "explain"}; bản ghi cũ lưu slot là chuỗi
+    thì coi chuỗi đó là title, thiếu / kiểu khác => {}."""
+    value = day.get(slot)
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        return {"title": value}
+    return {}
+
+
+def diff_itinerary(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Patch biến old thành new, ở mức slot: chỉ các slot / ngày đổi mới vào patch."""
+    ops = []
+    for key in old:
+        if key != "days" and key not in new:
+            ops.append({"op": "remove", "path": f"/{_escape(key)}"})
+    for key, value in new.items():
+        if key != "days" and old.get(key, _MISSING) != value:
+            ops.append({"op": "add" if key not in old else "replace", "path": f"/{_escape(key)}", "value": value})
+
+    old_days, new_days = old.get("days") or [], new.get("days") or []
+    for i, (a, b) in enumerate(zip(old_days, new_days)):
+        if a == b:
+            continue
+        if not isinstance(a, dict) or not isinstance(b, dict):
+            ops.append({"op": "replace", "path": f"/days/{i}", "value": b})
+            continue
+        for key in a:
+            if key not in b:
+                ops.append({"op": "remove", "path": f"/days/{i}/{_escape(key)}"})
+        for key, value in b.items():
+            if a.get(key, _MISSING) != value:
+                ops.append({"op": "add" if key not in a else "replace", "path": f"/days/{i}/{_escape(key)}", "value": value})
+    for day in new_days[len(old_days):]:
+        ops.append({"op": "add", "path": "/days/-", "value": day})
+    for i in range(len(old_days) - 1, len(new_days) - 1, -1):
+        ops.append({"op": "remove", "path": f"/days/{i}"})
+    return ops
@@ -0,0 +1,63 @@
+# itinerary_view.py - hiển thị itinerary trong Streamlit (phân trang, cache markdown)
+from typing import Dict, List
+
+import streamlit as st
+
+SLOTS = ["morning", "afternoon", "evening"]
+DAYS_PER_PAGE = 7
+
+
+def day_markdown(day: Dict) -> str:
+    """Một khối markdown cho cả ngày (1 lần st.markdown thay vì 2 lần / slot)."""
+    lines = [f"### 📅 {day.get('date', '')}"]
+    for slot in SLOTS:
+        s = day.get(slot)
+        if s and isinstance(s, dict):
+            lines.append(f"**{slot.capitalize()} — {s.get('title', '')}**  ")
+            lines.append(f"`{s.get('time', '')}` — {s.get('explain', '')}")
+            lines.append("")
+    return "\n".join(lines)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def day_blocks(itinerary_id: str, _days: List[Dict]) -> List[str]:
+    # _days không được hash: itinerary_id phải đổi khi nội dung đổi
+    return [day_markdown(day) for day in _days]
+
+
+def render_itinerary(data: Dict, itinerary_id: str, page_size: int = DAYS_PER_PAGE):
+    days = data.get("days", [])
+    blocks = day_blocks(itinerary_id, days)
+    if len(blocks) <= page_size:
+        st.markdown("\n\n".join(blocks))
+        return
+
+    pages = (len(blocks) + page_size - 1) // page_size
+    page = st.number_input(f"Trang (1-{pages}, {page_size} ngày / trang)",
+                           min_value=1, max_value=pages, value=1, step=1,
+                           key=f"page_{itinerary_id}")
+    first = (page - 1) * page_size
+    st.markdown("\n\n".join(blocks[first:first + page_size]))
+
+
+class StreamingItinerary:
+    """Thêm từng ngày vào UI khi /generate/stream trả về."""
+
+    def __init__(self, page_size: int = DAYS_PER_PAGE):
+        self.page_size = page_size
+        self.days: List[Dict] = []
+        self._blocks: List[str] = []
+        self._status = st.empty()
+        self._placeholder = st.empty()
+
+    def append(self, day: Dict):
+        self.days.append(day)
+        self._blocks.append(day_markdown(day))
+        self._status.caption(f"Đã nhận {len(self.days)} ngày...")
+        # chỉ vẽ lại trang cuối để chi phí mỗi lần cập nhật không tăng theo số ngày
+        first = (len(self._blocks) - 1) // self.page_size * self.page_size
+        self._placeholder.markdown("\n\n".join(self._blocks[first:]))
+
+    def finish(self):
+        self._status.empty()
+        self._placeholder.empty()
@@ -1,32 +1,46 @@
 import os
-from db import get_conn
-from datetime import datetime, timedelta
-from typing import Optional, List
-import json
-from sqlite3 import IntegrityError, OperationalError
+from datetime import datetime
+from typing import Optional, List, Tuple
+import time
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import jwt
-from passlib.context import CryptContext
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+import requests
+import orjson
 
-# ---------------------------
-# DB helpers
-from db import init_db, create_user, get_user_by_email, get_user_by_id, save_history, get_history_for_user
+import admin
+import request_log
+import degrade
+from profiler import install_profiler, profiler, run_in_threadpool
+from fastresponse import OrjsonResponse, install_compression
+from itinerary_builder import build_days
+from generation import OLLAMA_URLS, GenerationCancelled, configured_models, generate_itinerary, generate_slot
+from itinerary_patch import check_slot, current_slot, slot_patch
+from model_lifecycle import lifecycle
+from metrics import metrics
+from idempotency import run_idempotent
+from cost_model import cost_model, MAX_REQUEST_TOKENS
+from migrations import check_schema
+from auth import get_current_user_id, issue_session, refresh_session, revoke_refresh_token
+from passwords import hash_password, verify_password, check_rate_limit, shutdown_pool
 
 # ---------------------------
-# Password hashing
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# DB helpers
+from db import create_user, get_user_by_email, update_password_hash, save_history_entry, save_history_many, get_history_version, get_history_json_for_user, iter_history_ndjson, get_history_entry, add_history_patch, list_history_versions, save_history_revision
 
-# Config
-SECRET_KEY = os.environ.get("SECRET_KEY", "change_this_secret_for_prod")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
+# Batch generation
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "50"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "8"))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-generate")
 
-# App init
+# App init (schema do `python migrations.py` tạo; worker chỉ kiểm tra version lúc startup)
 app = FastAPI()
-init_db()
 
 # CORS
 app.add_middleware(
@@ -37,6 +51,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli cho response lớn (itinerary, history)
+install_compression(app)
+
+# Profiler + admin endpoints
+install_profiler(app)
+app.include_router(admin.router)
+
+@app.on_event("startup")
+def _startup():
+    check_schema()
+    request_log.start()
+    # hiệu chỉnh ước lượng cost (SJF + trần cost) theo history đã có
+    cost_model.calibrate_from_history()
+    # nạp sẵn model Ollama; /ready trả 503 tới khi xong
+    lifecycle.start(OLLAMA_URLS, configured_models())
+    degrade.upgrader.start()
+
+@app.on_event("shutdown")
+def _shutdown():
+    shutdown_pool()
+    request_log.stop()
+    lifecycle.stop()
+    degrade.upgrader.stop()
+
+@app.get("/ready")
+def ready():
+    """Readiness cho load balancer: chỉ nhận traffic sau khi model đã warm-up."""
+    if not lifecycle.ready:
+        return OrjsonResponse({"ready": False}, status_code=503)
+    return {"ready": True}
+
 # ---------------------------
 # Pydantic models
 class UserCreate(BaseModel):
@@ -47,6 +92,33 @@ class TokenResp(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class RefreshReq(BaseModel):
+    refresh_token: str
+
+class SlotEdit(BaseModel):
+    time: Optional[str] = None
+    title: str
+    explain: str = ""
+
+class SlotRegenerate(BaseModel):
+    hint: Optional[str] = None
+
+class ItinerarySlot(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    time: Optional[str] = ""
+    title: str = Field(min_length=1)
+    explain: Optional[str] = ""
+
+class ItineraryDay(BaseModel):
+    model_config = ConfigDict(extra="allow")  # date, ...
+    morning: ItinerarySlot
+    afternoon: ItinerarySlot
+    evening: ItinerarySlot
+
+class ItineraryRevision(BaseModel):
+    # cùng dạng với output đã qua generation.validate_itinerary: sai dạng => 422
+    days: List[ItineraryDay] = Field(min_length=1)
+
 class ItineraryRequest(BaseModel):
     origin: str
     destination: str
@@ -55,94 +127,371 @@ class ItineraryRequest(BaseModel):
     interests: List[str]
     pace: str
 
-# ---------------------------
-# Auth helpers
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return int(payload.get("sub"))
-    except Exception:
-        return None
-
 # ---------------------------
 # Register / Login
 @app.post("/register")
-def register(user: UserCreate):
+async def register(user: UserCreate, request: Request, idempotency_key: Optional[str] = Header(None)):
+    check_rate_limit(user.email, request.client.host if request.client else None)
+    if idempotency_key is None:
+        return await create_account(user)
+
+    async def compute():
+        return OrjsonResponse(await create_account(user))
+    # Không lưu token: lần thử lại nhận một session mới của cùng user
+    return await run_idempotent("register", idempotency_key, user.dict(), compute,
+                                save=lambda r: orjson.dumps({"user_id": orjson.loads(r.body)["user_id"]}),
+                                replay=replay_session)
+
+async def replay_session(stored: bytes) -> Response:
+    return OrjsonResponse(await run_in_threadpool(issue_session, orjson.loads(stored)["user_id"]))
+
+async def create_account(user: UserCreate) -> dict:
     try:
-        existing = get_user_by_email(user.email)
+        existing = await run_in_threadpool(get_user_by_email, user.email)
         if existing:
             raise HTTPException(status_code=400, detail="Email already registered")
-        pw_hash = pwd_context.hash(user.password)
-        uid = create_user(user.email, pw_hash)
-        token = create_access_token({"sub": str(uid)})
-        return {"user_id": uid, "access_token": token}
+        pw_hash = await hash_password(user.password)
+        uid = await run_in_threadpool(create_user, user.email, pw_hash)
+        return await run_in_threadpool(issue_session, uid)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
 @app.post("/login")
-def login(user: UserCreate):
-    existing = get_user_by_email(user.email)
-    if not existing or not pwd_context.verify(user.password, existing["password_hash"]):
+async def login(user: UserCreate, request: Request):
+    check_rate_limit(user.email, request.client.host if request.client else None)
+    existing = await run_in_threadpool(get_user_by_email, user.email)
+    if not existing:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token({"sub": str(existing["id"])})
-    return {"user_id": existing["id"], "access_token": token}
+    ok, new_hash = await verify_password(user.password, existing["password_hash"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        await run_in_threadpool(update_password_hash, existing["id"], new_hash)
+    return await run_in_threadpool(issue_session, existing["id"])
 
 # ---------------------------
-# Generate itinerary (mock)
-@app.post("/generate")
-def generate(req: ItineraryRequest, authorization: Optional[str] = Header(None)):
-    # --- Xác thực token ---
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-    token = authorization.split()[1]
-    user_id = verify_token(token)
-    if user_id is None:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    # --- Parse dates ---
+# Refresh / revoke (không cần verify lại mật khẩu)
+@app.post("/token/refresh")
+def token_refresh(body: RefreshReq):
+    tokens = refresh_session(body.refresh_token)
+    if tokens is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return tokens
+
+@app.post("/token/revoke")
+def token_revoke(body: RefreshReq):
+    revoke_refresh_token(body.refresh_token)
+    return {"ok": True}
+
+# ---------------------------
+# Generate itinerary
+def parse_dates(req: ItineraryRequest):
     try:
         start = datetime.fromisoformat(req.start_date).date()
         end = datetime.fromisoformat(req.end_date).date()
-        if end < start:
-            raise HTTPException(status_code=400, detail="end_date must be after start_date")
-    except Exception as e:
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Invalid date format: {str(e)}")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must be after start_date")
+    # Trần cost: từ chối khoảng ngày vô lý trước khi xếp hàng / sinh
+    cost = cost_model.estimate_request(start, end, req.interests, req.pace)
+    if cost > MAX_REQUEST_TOKENS:
+        raise HTTPException(status_code=413, detail=f"Trip too long: estimated {int(cost)} tokens exceeds limit {MAX_REQUEST_TOKENS}")
+    return start, end
+
+def history_summary(req: ItineraryRequest, entry: dict, num_days: int) -> dict:
+    # Trả luôn id + tóm tắt để client thêm vào sidebar, khỏi gọi lại /history
+    return {
+        "id": entry["id"],
+        "created_at": entry["created_at"],
+        "origin": req.origin,
+        "destination": req.destination,
+        "start_date": req.start_date,
+        "end_date": req.end_date,
+        "num_days": num_days,
+    }
+
+def build_itinerary(req: ItineraryRequest, cancel: Optional[threading.Event] = None,
+                    deadline: Optional[float] = None, on_day=None) -> dict:
+    start, end = parse_dates(req)
+    return generate_itinerary(req.dict(), start, end, cancel=cancel, deadline=deadline, on_day=on_day)
+
+async def watch_request(request: Request, cancel: threading.Event, deadline: Optional[float]):
+    """Báo huỷ cho worker khi client ngắt kết nối hoặc quá deadline."""
+    while not cancel.is_set():
+        if await request.is_disconnected():
+            cancel.set()
+            return
+        if deadline is not None and time.monotonic() >= deadline:
+            return  # worker tự thấy deadline qua check_cancel
+        await asyncio.sleep(0.1)
+
+@app.post("/generate")
+async def generate(req: ItineraryRequest, request: Request,
+                   x_deadline_ms: Optional[int] = Header(None),
+                   idempotency_key: Optional[str] = Header(None),
+                   user_id: int = Depends(get_current_user_id)):
+    # X-Deadline-Ms: thời gian client còn chờ (ms, tương đối để tránh lệch đồng hồ)
+    deadline = time.monotonic() + x_deadline_ms / 1000 if x_deadline_ms else None
+    if idempotency_key is None:
+        return await run_generate(req, request, user_id, deadline)
+    # Client thử lại (timeout, bấm 2 lần) với cùng key: không sinh + lưu history lần nữa
+    return await run_idempotent(f"generate:{user_id}", idempotency_key, req.dict(),
+                                lambda: run_generate(req, request, user_id, deadline))
+
+async def run_generate(req: ItineraryRequest, request: Request, user_id: int, deadline: Optional[float]) -> Response:
+    with request_log.record("/generate", req.dict()):
+        result, entry = await generate_and_save(req, request, user_id, deadline)
+    return OrjsonResponse({**result, "history_id": entry["id"], "history": history_summary(req, entry, len(result["days"]))})
 
-    # --- Tạo itinerary cho từng ngày ---
-    days = []
-    delta_days = (end - start).days + 1  # số ngày cần generate
-    for i in range(delta_days):
-        current_date = start + timedelta(days=i)
-        day = {
-            "date": current_date.isoformat(),
-            "morning": {"time":"08:00","title":"Morning walk","explain":"Explore local streets."},
-            "afternoon": {"time":"13:00","title":"Museum visit","explain":"Enjoy history and culture."},
-            "evening": {"time":"18:00","title":"Dinner & Nightlife","explain":"Try local cuisine."}
-        }
-        days.append(day)
-
-    result = {"days": days}
+async def generate_and_save(req: ItineraryRequest, request: Request, user_id: int,
+                            deadline: Optional[float], on_day=None,
+                            cancel: Optional[threading.Event] = None) -> Tuple[dict, dict]:
+    """Sinh itinerary (hoặc bản degraded khi quá tải) rồi lưu history; trả (itinerary, history entry).
+    on_day: xem generation.generate_itinerary (bản degraded gửi hết các ngày một lần)."""
+    reason = degrade.overload_reason()
+    if reason is not None:
+        result, entry = await run_in_threadpool(generate_degraded, req, user_id, reason)
+        for day in result["days"] if on_day is not None else ():
+            on_day(day)
+        return result, entry
+    started = time.perf_counter()
+    result = await run_cancellable(request, deadline, partial(build_itinerary, on_day=on_day), req, cancel=cancel)
+    degrade.record_latency(time.perf_counter() - started)
 
     # --- Lưu lịch sử ---
-    save_history(user_id, req.dict(), result)
-    return result
+    entry = await run_in_threadpool(save_history_entry, user_id, req.dict(), result)
+    return result, entry
+
+async def run_cancellable(request: Request, deadline: Optional[float], fn, *args,
+                          cancel: Optional[threading.Event] = None):
+    """Chạy fn(*args, cancel, deadline) trong threadpool; client ngắt kết nối
+    hoặc quá deadline (hoặc ai đó set `cancel`) thì worker dừng và trả slot model ngay."""
+    cancel = cancel or threading.Event()
+    watcher = asyncio.create_task(watch_request(request, cancel, deadline))
+    try:
+        return await run_in_threadpool(fn, *args, cancel, deadline)
+    except GenerationCancelled as e:
+        metrics.incr(f"generate.cancelled.{e.reason}")
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
+        # client đã đi: không ai đọc response, cũng không lưu gì
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except (requests.RequestException, ValueError) as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            # read timeout của request tới model được đặt theo deadline
+            metrics.incr("generate.cancelled.deadline")
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
+        raise HTTPException(status_code=502, detail=f"Model backend error: {str(e)}")
+    finally:
+        watcher.cancel()
+
+def generate_degraded(req: ItineraryRequest, user_id: int, reason: str) -> Tuple[dict, dict]:
+    """Model quá tải: trả ngay itinerary dựng từ interests/pace ("degraded": true);
+    bản đầy đủ được sinh ở nền và thay vào history (nếu bật)."""
+    metrics.incr(f"generate.degraded.{reason}")
+    start, end = parse_dates(req)
+    result = {"days": build_days(start, end, req.interests, req.pace), "degraded": True}
+    entry = save_history_entry(user_id, req.dict(), result)
+    degrade.upgrader.submit(user_id, entry["id"], req.dict(), start, end)
+    return result, entry
+
+@app.post("/generate/batch")
+def generate_batch(reqs: List[ItineraryRequest], user_id: int = Depends(get_current_user_id)):
+    """Nhiều itinerary trong một lần gọi: token verify 1 lần, sinh song song
+    (pool giới hạn), lưu toàn bộ history trong 1 transaction. Kết quả giữ
+    nguyên thứ tự; item lỗi trả {"ok": false, "status", "detail"}."""
+    if not reqs:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(reqs) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE})")
+
+    with request_log.record("/generate/batch", {"items": [r.dict() for r in reqs]}):
+        futures = [batch_pool.submit(profiler.bind(build_itinerary), r) for r in reqs]
+        results = []
+        for req, fut in zip(reqs, futures):
+            try:
+                results.append({"ok": True, **fut.result()})
+            except HTTPException as e:
+                results.append({"ok": False, "status": e.status_code, "detail": e.detail})
+            except Exception as e:
+                results.append({"ok": False, "status": 500, "detail": f"Generate failed: {str(e)}"})
+
+        ok = [(req, res) for req, res in zip(reqs, results) if res["ok"]]
+        entries = save_history_many(user_id, [(req.dict(), {"days": res["days"]}) for req, res in ok])
+        for (req, res), entry in zip(ok, entries):
+            res["history_id"] = entry["id"]
+            res["history"] = history_summary(req, entry, len(res["days"]))
+        return OrjsonResponse({"results": results})
+
+@app.post("/generate/stream")
+async def generate_stream(req: ItineraryRequest, request: Request,
+                          x_deadline_ms: Optional[int] = Header(None),
+                          idempotency_key: Optional[str] = Header(None),
+                          user_id: int = Depends(get_current_user_id)):
+    """NDJSON: mỗi dòng {"day": {...}} gửi ngay khi model sinh xong ngày đó,
+    dòng cuối {"done": true, ...} (history đã lưu) hoặc {"error": {"status", "detail"}}.
+
+    Cùng đường sinh với /generate (scheduler, tier, degraded, huỷ/deadline).
+    Lỗi trước ngày đầu tiên vẫn trả đúng status HTTP (504/499/502); sau đó
+    thì không đổi status được nữa nên kết thúc bằng dòng "error" (vd ngày
+    sau không hợp lệ: không chạy lại trên model lớn vì client đã nhận output
+    của model nhỏ). Stream kết thúc bằng "error" thì không lưu history.
+    """
+    deadline = time.monotonic() + x_deadline_ms / 1000 if x_deadline_ms else None
+    if idempotency_key is None:
+        return await run_generate_stream(req, request, user_id, deadline)
+    # stream hoàn chỉnh (có dòng done) được lưu và trả lại nguyên vẹn cho lần thử lại
+    return await run_idempotent(f"generate-stream:{user_id}", idempotency_key, req.dict(),
+                                lambda: run_generate_stream(req, request, user_id, deadline),
+                                replay=replay_ndjson, save_stream=completed_ndjson)
+
+async def run_generate_stream(req: ItineraryRequest, request: Request, user_id: int,
+                              deadline: Optional[float]) -> Response:
+    parse_dates(req)  # input sai -> 400/413 trước khi sinh
+    loop = asyncio.get_running_loop()
+    lines: asyncio.Queue = asyncio.Queue()
+    cancel = threading.Event()
+
+    def on_day(day: dict):
+        # gọi từ worker thread (hoặc event loop với bản degraded)
+        loop.call_soon_threadsafe(lines.put_nowait, {"day": day})
+
+    async def produce():
+        try:
+            with request_log.record("/generate/stream", req.dict()):
+                result, entry = await generate_and_save(req, request, user_id, deadline, on_day, cancel)
+            done = {"done": True, "history_id": entry["id"], "history": history_summary(req, entry, len(result["days"]))}
+            if result.get("degraded"):
+                done["degraded"] = True
+            lines.put_nowait(done)
+        except HTTPException as e:
+            lines.put_nowait({"error": {"status": e.status_code, "detail": e.detail}})
+        except Exception as e:
+            lines.put_nowait({"error": {"status": 500, "detail": f"Generate failed: {str(e)}"}})
+
+    task = asyncio.create_task(produce())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    first = await lines.get()
+    if "error" in first:
+        raise HTTPException(status_code=first["error"]["status"], detail=first["error"]["detail"])
+
+    async def body():
+        line = first
+        try:
+            while True:
+                yield orjson.dumps(line) + b"\n"
+                if "day" not in line:
+                    return
+                line = await lines.get()
+        finally:
+            # client đóng stream giữa chừng: dừng sinh, không lưu history
+            cancel.set()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+# task sinh của các stream đang mở (giữ tham chiếu tới khi xong)
+_stream_tasks = set()
+
+def completed_ndjson(body: bytes) -> Optional[bytes]:
+    """Chỉ lưu cho Idempotency-Key stream đã tới dòng done."""
+    last = body.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+    return body if orjson.loads(last).get("done") else None
+
+async def replay_ndjson(stored: bytes) -> Response:
+    return Response(content=stored, media_type="application/x-ndjson")
+
 # ---------------------------
 # History endpoint
 @app.get("/history")
-def history(authorization: Optional[str] = Header(None), limit: int = 50):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-    token = authorization.split()[1]
-    user_id = verify_token(token)
-    if user_id is None:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    items = get_history_for_user(user_id, limit=limit)
-    return {"history": items}
+def history(limit: int = 50, since_id: Optional[int] = None,
+            if_none_match: Optional[str] = Header(None),
+            user_id: int = Depends(get_current_user_id)):
+    # ETag rẻ (MAX(id), COUNT(*) qua index) => history không đổi trả 304, không body
+    max_id, count, revision = get_history_version(user_id)
+    etag = f'W/"h{user_id}-{max_id}-{count}-{revision}-{limit}-{since_id or 0}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    # JSON đã lưu sẵn trong DB được ghép thẳng vào body, không decode/encode lại
+    body = get_history_json_for_user(user_id, limit=limit, since_id=since_id)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+@app.get("/history/export")
+def history_export(cursor: int = 0, user_id: int = Depends(get_current_user_id)):
+    """Toàn bộ history dạng NDJSON (gzip nếu client gửi Accept-Encoding).
+    Bị ngắt giữa chừng thì gọi lại với cursor = id của dòng cuối đã nhận."""
+    return StreamingResponse(iter_history_ndjson(user_id, after_id=cursor),
+                             media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="history-{user_id}.ndjson"'})
+
+# ---------------------------
+# Sửa / sinh lại một slot của itinerary đã lưu (lưu patch, không lưu bản mới)
+def load_slot_entry(user_id: int, history_id: int, day_index: int, slot: str) -> dict:
+    entry = get_history_entry(user_id, history_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    try:
+        check_slot(entry["response"], day_index, slot)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return entry
+
+def save_slot(user_id: int, entry: dict, day_index: int, slot: str, value: dict) -> dict:
+    try:
+        version = add_history_patch(user_id, entry["id"], slot_patch(day_index, slot, value))
+    except ValueError as e:  # itinerary vừa bị đổi cấu trúc bởi revision khác
+        raise HTTPException(status_code=409, detail=str(e))
+    if version is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return {"history_id": entry["id"], "day_index": day_index, "slot": slot, "value": value, "version": version}
+
+@app.put("/history/{history_id}/days/{day_index}/{slot}")
+def edit_slot(history_id: int, day_index: int, slot: str, body: SlotEdit,
+              user_id: int = Depends(get_current_user_id)):
+    entry = load_slot_entry(user_id, history_id, day_index, slot)
+    current = current_slot(entry["response"]["days"][day_index], slot)
+    value = {"time": body.time or current.get("time", ""), "title": body.title, "explain": body.explain}
+    return save_slot(user_id, entry, day_index, slot, value)
+
+@app.post("/history/{history_id}/days/{day_index}/{slot}/regenerate")
+async def regenerate_slot(history_id: int, day_index: int, slot: str, request: Request,
+                          body: Optional[SlotRegenerate] = None,
+                          x_deadline_ms: Optional[int] = Header(None),
+                          user_id: int = Depends(get_current_user_id)):
+    """Sinh lại một slot bằng prompt ngắn (chỉ ngày đó làm ngữ cảnh)."""
+    deadline = time.monotonic() + x_deadline_ms / 1000 if x_deadline_ms else None
+    entry = await run_in_threadpool(load_slot_entry, user_id, history_id, day_index, slot)
+    day = entry["response"]["days"][day_index]
+    value = await run_cancellable(request, deadline, generate_slot, entry["request"], day, slot, body.hint if body else None)
+    value = {k: value.get(k, "") for k in ("time", "title", "explain")}
+    return await run_in_threadpool(save_slot, user_id, entry, day_index, slot, value)
+
+# ---------------------------
+# Version của itinerary (version 1 = bản gốc, sau đó lưu delta)
+@app.get("/history/{history_id}/versions")
+def history_versions(history_id: int, user_id: int = Depends(get_current_user_id)):
+    versions = list_history_versions(user_id, history_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return {"history_id": history_id, "versions": versions}
+
+@app.get("/history/{history_id}/versions/{version}")
+def history_version(history_id: int, version: int, user_id: int = Depends(get_current_user_id)):
+    entry = get_history_entry(user_id, history_id, version=version)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return OrjsonResponse(entry)
+
+@app.post("/history/{history_id}/versions")
+def history_new_version(history_id: int, body: ItineraryRevision, user_id: int = Depends(get_current_user_id)):
+    """Lưu itinerary đã sửa thành version mới (chỉ phần khác với version hiện tại được lưu)."""
+    try:
+        version = save_history_revision(user_id, history_id, body.dict())
+    except ValueError as e:  # delta không áp được lên version hiện tại
+        raise HTTPException(status_code=409, detail=str(e))
+    if version is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return {"history_id": history_id, "version": version}
@@ -0,0 +1,78 @@
+# metrics.py - bộ đếm + thống kê latency trong process (xem qua /admin/metrics)
+import threading
+from collections import defaultdict, deque
+from typing import Callable, Optional
+
+WINDOW = 1024  # số mẫu gần nhất giữ lại để tính percentile
+
+
+class _Timer:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[idx]
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timers = defaultdict(_Timer)
+        self._gauges = {}
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            t = self._timers[name]
+            t.count += 1
+            t.total += seconds
+            t.max = max(t.max, seconds)
+            t.recent.append(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        """Giá trị đọc tại thời điểm gọi snapshot (vd độ dài hàng chờ)."""
+        with self._lock:
+            self._gauges[name] = read
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """Percentile (giây) trên cửa sổ mẫu gần nhất, None nếu chưa có mẫu."""
+        with self._lock:
+            t = self._timers.get(name)
+            if t is None or not t.recent:
+                return None
+            values = sorted(t.recent)
+        return _percentile(values, q)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            gauges = dict(self._gauges)
+            timers = {}
+            for name, t in self._timers.items():
+                values = sorted(t.recent)
+                timers[name] = {
+                    "count": t.count,
+                    "avg_ms": round(t.total / t.count * 1000, 3) if t.count else 0.0,
+                    "max_ms": round(t.max * 1000, 3),
+                    "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+                    "p95_ms": round(_percentile(values, 0.95) * 1000, 3),
+                    "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+                }
+            counters = dict(self._counters)
+        return {"counters": counters, "timers": timers,
+                "gauges": {name: read() for name, read in gauges.items()}}
+
+
+metrics = Metrics()
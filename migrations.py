@@ -0,0 +1,283 @@
+# migrations.py - schema SQLite đánh số theo PRAGMA user_version
+#
+#   python migrations.py            # chạy các migration còn thiếu (trước khi deploy worker mới)
+#   python migrations.py --status   # in version hiện tại / version code cần
+#
+# Worker (main.py, api.py) không tạo bảng nữa: lúc startup chỉ đọc
+# user_version (check_schema) và từ chối chạy nếu DB cũ hơn code.
+#
+# Quy tắc để migration chạy được khi server vẫn đang phục vụ:
+# - DB ở chế độ WAL: đọc không bị chặn bởi transaction ghi.
+# - Mỗi migration là một transaction ngắn (DDL + tăng user_version cùng lúc),
+#   ALTER TABLE ADD COLUMN trong SQLite chỉ sửa schema, không ghi lại bảng.
+# - Dữ liệu cần điền lại trên bảng lớn (history) dùng backfill() / in_batches():
+#   từng lô nhỏ, mỗi lô một transaction, nghỉ giữa các lô để request ghi chen
+#   vào. Migration kiểu này đánh dấu @batched (migrate() không bọc nó trong
+#   một transaction, chỉ tăng user_version khi chạy xong) và phải tự loại các
+#   dòng đã xử lý để chạy lại được sau khi bị ngắt.
+# - CREATE INDEX giữ khoá ghi trong lúc dựng index: chạy lúc traffic thấp.
+import sys
+import json
+import time
+import argparse
+import sqlite3
+from typing import Callable, List, Tuple
+
+import db
+from db import get_conn
+from itinerary_patch import apply_patch
+
+
+FOLD_BATCH_SIZE = 200  # số itinerary mỗi lô khi gộp history_patches (v6)
+
+
+def batched(fn):
+    """Migration tự quản lý transaction (backfill / in_batches): migrate()
+    gọi nó ngoài transaction và chỉ tăng user_version sau khi nó chạy xong."""
+    fn.batched = True
+    return fn
+
+
+def _v1_users_history(c: sqlite3.Connection):
+    # users table: Email phải là UNIQUE
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TEXT
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        request_json TEXT NOT NULL,
+        response_json TEXT NOT NULL,
+        created_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+
+
+def _v2_sessions(c: sqlite3.Connection):
+    # sessions table: refresh token (chỉ lưu sha256 digest)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        token_hash BLOB UNIQUE NOT NULL,
+        expires_at INTEGER NOT NULL,
+        revoked INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+
+
+def _v3_history_user_index(c: sqlite3.Connection):
+    # history theo user, mới nhất trước (dùng cho /history và ?since_id=)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_user ON history(user_id, id)")
+
+
+def _v4_idempotency_keys(c: sqlite3.Connection):
+    # idempotency_keys: kết quả của request có Idempotency-Key (status NULL = đang xử lý)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key_hash BLOB PRIMARY KEY,
+        fingerprint BLOB NOT NULL,
+        status INTEGER,
+        response BLOB,
+        expires_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)")
+
+
+def _v5_history_versions(c: sqlite3.Connection):
+    # history_versions: các version sau bản gốc (history.response_json = version 1)
+    # dưới dạng delta JSON Patch so với version trước; định kỳ kèm snapshot đầy đủ
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS history_versions (
+        history_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        patch_json TEXT NOT NULL,
+        snapshot_json TEXT,
+        created_at TEXT,
+        PRIMARY KEY (history_id, version),
+        FOREIGN KEY(history_id) REFERENCES history(id)
+    ) WITHOUT ROWID
+    """)
+    # history_revisions: đếm số lần history của user bị sửa tại chỗ (vào ETag /history)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS history_revisions (
+        user_id INTEGER PRIMARY KEY,
+        revision INTEGER NOT NULL
+    )
+    """)
+
+
+@batched
+def _v6_fold_history_patches(c: sqlite3.Connection):
+    # history_patches (sửa slot, trước khi có history_versions) -> các version 2, 3, ...
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_patches'").fetchone():
+        return
+    in_batches(c, lambda conn: _fold_patch_batch(conn, FOLD_BATCH_SIZE))
+    # còn lại: bản ghi đã có history_versions, được sửa trên bản chưa áp patch
+    # cũ => giữ các version đó, bỏ patch cũ
+    c.execute("DROP TABLE history_patches")
+
+
+def _fold_patch_batch(c: sqlite3.Connection, batch_size: int) -> bool:
+    ids = [r[0] for r in c.execute(
+        "SELECT DISTINCT history_id FROM history_patches p "
+        "WHERE NOT EXISTS (SELECT 1 FROM history_versions v WHERE v.history_id = p.history_id) "
+        "ORDER BY history_id LIMIT ?", (batch_size,))]
+    if not ids:
+        return False
+    marks = ",".join("?" * len(ids))
+    rows = c.execute("SELECT p.history_id, p.patch_json, p.created_at, h.response_json FROM history_patches p "
+                     f"JOIN history h ON h.id = p.history_id WHERE p.history_id IN ({marks}) "
+                     "ORDER BY p.history_id, p.id", ids).fetchall()
+    docs = {}
+    for history_id, patch_json, created_at, response_json in rows:
+        doc, version = docs.get(history_id) or (json.loads(response_json), 1)
+        try:
+            apply_patch(doc, json.loads(patch_json), in_place=True)
+        except ValueError:
+            continue  # patch không áp được thì lúc đọc cũng đã lỗi
+        version += 1
+        snapshot = json.dumps(doc, ensure_ascii=False) if (version - 1) % db.HISTORY_REBASE_EVERY == 0 else None
+        c.execute("INSERT INTO history_versions (history_id, version, patch_json, snapshot_json, created_at) "
+                  "VALUES (?,?,?,?,?)", (history_id, version, patch_json, snapshot, created_at))
+        docs[history_id] = (doc, version)
+    # cùng transaction với các version vừa thêm: chạy lại không gộp trùng
+    c.execute(f"DELETE FROM history_patches WHERE history_id IN ({marks})", ids)
+    return len(ids) == batch_size
+
+
+# (version, mô tả, hàm). Chỉ thêm vào cuối, không sửa migration đã phát hành.
+# Các migration đầu dùng IF NOT EXISTS vì DB cũ (tạo bởi init_db() trước khi
+# có file này) đã có bảng nhưng user_version = 0.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "users and history tables", _v1_users_history),
+    (2, "refresh token sessions", _v2_sessions),
+    (3, "history (user_id, id) index", _v3_history_user_index),
+    (4, "idempotency keys", _v4_idempotency_keys),
+    (5, "itinerary versions and history revisions", _v5_history_versions),
+    (6, "fold slot patches into itinerary versions", _v6_fold_history_patches),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def in_batches(conn: sqlite3.Connection, step: Callable[[sqlite3.Connection], bool],
+               pause: float = 0.05):
+    """Gọi step(conn) trong một transaction riêng mỗi lần, tới khi step trả False."""
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            more = step(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not more:
+            return
+        time.sleep(pause)
+
+
+def backfill(conn: sqlite3.Connection, table: str, assignments: str, where: str,
+             batch_size: int = 1000, pause: float = 0.05) -> int:
+    """UPDATE {table} SET {assignments} theo lô `batch_size` dòng thoả {where}.
+
+    Dùng trong migration @batched. Mỗi lô là một transaction riêng nên khoá
+    ghi chỉ giữ trong thời gian một lô; `where` phải loại các dòng đã cập
+    nhật (vd `new_col IS NULL`). Trả về tổng số dòng đã cập nhật.
+    """
+    total = 0
+
+    def step(c: sqlite3.Connection) -> bool:
+        nonlocal total
+        cur = c.execute(f"UPDATE {table} SET {assignments} WHERE rowid IN "
+                        f"(SELECT rowid FROM {table} WHERE {where} LIMIT ?)", (batch_size,))
+        total += cur.rowcount
+        return cur.rowcount == batch_size
+
+    in_batches(conn, step, pause)
+    return total
+
+
+def migrate(target: int = SCHEMA_VERSION, verbose: bool = True) -> int:
+    """Chạy các migration còn thiếu tới `target`; trả về version sau cùng."""
+    conn = get_conn()
+    conn.isolation_level = None  # tự quản lý transaction
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        version = current_version(conn)
+        for number, description, apply in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+            started = time.perf_counter()
+            if getattr(apply, "batched", False):
+                # tự commit từng lô; bị ngắt thì version giữ nguyên, lần sau chạy lại
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            else:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    apply(conn)
+                    conn.execute(f"PRAGMA user_version = {number}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            version = number
+            if verbose:
+                print(f"migrated to {number}: {description} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+        return version
+    finally:
+        conn.close()
+
+
+def check_schema():
+    """Gọi lúc worker startup: chỉ đọc user_version, không tạo/sửa gì.
+
+    DB mới hơn code vẫn chạy được (migration chỉ thêm, không xoá) - tiện khi
+    deploy cuốn chiếu; DB cũ hơn thì dừng ngay với hướng dẫn chạy migration.
+    """
+    conn = get_conn()
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    if version < SCHEMA_VERSION:
+        raise RuntimeError(f"Database {db.DB_FILE} is at schema version {version}, "
+                           f"this code needs {SCHEMA_VERSION}: run `python migrations.py` first")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply SQLite schema migrations")
+    parser.add_argument("--status", action="store_true", help="print current and required schema version")
+    parser.add_argument("--target", type=int, default=SCHEMA_VERSION, help="migrate up to this version")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        conn = get_conn()
+        try:
+            version = current_version(conn)
+        finally:
+            conn.close()
+        print(f"{db.DB_FILE}: schema version {version}, code requires {SCHEMA_VERSION}")
+        return 0 if version >= SCHEMA_VERSION else 1
+    version = migrate(args.target)
+    print(f"{db.DB_FILE}: schema version {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
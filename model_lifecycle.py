@@ -0,0 +1,110 @@
+# model_lifecycle.py - nạp sẵn model Ollama lúc startup và giữ model trong RAM
+#
+# Ollama gỡ model sau OLLAMA_KEEP_ALIVE không dùng; request đầu tiên sau đó
+# phải chờ nạp lại model (vài giây). Lúc startup mỗi model được nạp một lần
+# (server chỉ "ready" sau bước này), sau đó thread nền ping các model không
+# được dùng gần đây - nhưng chỉ khi còn traffic: im lặng quá MODEL_IDLE_UNLOAD
+# giây thì thôi ping để Ollama giải phóng RAM.
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from metrics import metrics
+
+OLLAMA_KEEP_ALIVE = int(os.environ.get("OLLAMA_KEEP_ALIVE", "300"))  # giây Ollama giữ model
+MODEL_IDLE_UNLOAD = int(os.environ.get("MODEL_IDLE_UNLOAD", "3600"))  # không traffic => để model bị gỡ
+COLD_START_THRESHOLD = 0.5  # load_duration (giây) lớn hơn => tính là cold start
+
+logger = logging.getLogger("trip.models")
+
+
+def record_load(model: str, load_seconds: float, source: str):
+    """Ghi nhận load_duration Ollama trả về; source: "warmup" | "keepalive" | "request"."""
+    metrics.observe("model.load", load_seconds)
+    if load_seconds >= COLD_START_THRESHOLD:
+        metrics.incr(f"model.cold_start.{source}")
+        if source == "request":
+            logger.warning("cold start of %s during a request (%.1fs load)", model, load_seconds)
+
+
+class ModelLifecycle:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._targets: List[Tuple[str, str]] = []  # (backend url, model)
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._last_traffic = time.monotonic()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self, urls: List[str], models: List[str]):
+        """Gọi lúc startup; warm-up (mọi model trên mọi backend) chạy nền để
+        uvicorn vẫn nhận /ready trong lúc chờ."""
+        if self._thread is not None:
+            return
+        if not urls:
+            self._ready.set()  # không dùng LLM (builder) => luôn sẵn sàng
+            return
+        self._targets = [(url, m) for url in urls for m in dict.fromkeys(models) if m]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-lifecycle", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def touch(self, url: str, model: str):
+        """Model vừa phục vụ một request (bản thân request đã giữ model ấm)."""
+        now = time.monotonic()
+        with self._lock:
+            self._last_used[(url, model)] = now
+            self._last_traffic = now
+
+    def _load(self, url: str, model: str, source: str):
+        r = requests.post(f"{url}/api/generate",
+                          json={"model": model, "keep_alive": f"{OLLAMA_KEEP_ALIVE}s"}, timeout=(5, 300))
+        r.raise_for_status()
+        record_load(model, r.json().get("load_duration", 0) / 1e9, source)
+        with self._lock:
+            self._last_used[(url, model)] = time.monotonic()
+
+    def _run(self):
+        for url, model in self._targets:
+            started = time.perf_counter()
+            try:
+                self._load(url, model, "warmup")
+                logger.info("warmed up %s on %s in %.1fs", model, url, time.perf_counter() - started)
+            except requests.RequestException as e:
+                metrics.incr("model.warmup_failed")
+                logger.warning("warm-up of %s on %s failed: %s", model, url, e)
+        self._ready.set()
+
+        # ping trước khi Ollama hết keep-alive (80%)
+        interval = OLLAMA_KEEP_ALIVE * 0.8
+        while not self._stop.wait(min(interval, 30)):
+            now = time.monotonic()
+            with self._lock:
+                idle = now - self._last_traffic
+                due = [t for t in self._targets if now - self._last_used.get(t, 0) >= interval]
+            if idle > MODEL_IDLE_UNLOAD:
+                continue
+            for url, model in due:
+                try:
+                    self._load(url, model, "keepalive")
+                    metrics.incr("model.keepalive")
+                except requests.RequestException as e:
+                    logger.warning("keep-alive ping to %s on %s failed: %s", model, url, e)
+
+
+lifecycle = ModelLifecycle()
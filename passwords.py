@@ -0,0 +1,181 @@
+# passwords.py - hash/verify mật khẩu trong process pool riêng
+#
+# pbkdf2 tốn hàng chục-trăm ms CPU và giữ GIL, nên chạy ngoài worker của
+# FastAPI để login/register dồn dập không làm nghẽn /generate, /history.
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from metrics import metrics
+from profiler import profiler
+from ratelimit import RateLimiter
+
+# ---------------------------
+# Password hashing
+# Số vòng pbkdf2 chỉnh theo phần cứng: `python passwords.py --target-ms 250`.
+# min/max = default nên hash cũ có số vòng khác sẽ được hash lại khi login.
+PBKDF2_ROUNDS = int(os.environ.get("PBKDF2_ROUNDS", "29000"))
+
+
+def make_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto",
+                        pbkdf2_sha256__default_rounds=rounds,
+                        pbkdf2_sha256__min_rounds=rounds,
+                        pbkdf2_sha256__max_rounds=rounds)
+
+
+pwd_context = make_context(PBKDF2_ROUNDS)
+
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", "64"))
+LOGIN_RATE_PER_EMAIL = int(os.environ.get("LOGIN_RATE_PER_EMAIL", "10"))  # / phút
+LOGIN_RATE_PER_IP = int(os.environ.get("LOGIN_RATE_PER_IP", "60"))  # / phút
+
+
+_email_limiter = RateLimiter(LOGIN_RATE_PER_EMAIL, 60)
+_ip_limiter = RateLimiter(LOGIN_RATE_PER_IP, 60)
+
+
+# Chạy trong process con
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(password: str, password_hash: str):
+    """Trả về (đúng mật khẩu?, hash mới nếu hash cũ cần nâng cấp - needs_update)."""
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn thay vì fork: fork một process nhiều thread dễ deadlock
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _replace_broken_pool(broken: ProcessPoolExecutor):
+    """Một process con chết (vd OOM kill) làm hỏng cả pool: bỏ pool đó, lần
+    gọi sau tạo pool mới. Nhiều request cùng thấy lỗi chỉ thay pool một lần."""
+    global _pool
+    with _lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _submit(metric: str, fn, *args):
+    global _pending
+    with _lock:
+        if _pending >= HASH_QUEUE_LIMIT:
+            metrics.incr("password.rejected")
+            raise HTTPException(status_code=503, detail="Server busy, try again later",
+                                headers={"Retry-After": "1"})
+        _pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            metrics.incr("password.pool_restarted")
+            _replace_broken_pool(pool)
+            return await loop.run_in_executor(_get_pool(), fn, *args)
+    finally:
+        with _lock:
+            _pending -= 1
+        elapsed = time.perf_counter() - start
+        metrics.observe(metric, elapsed)
+        profiler.record_offloaded(f"process_pool:{metric}", elapsed)
+
+
+async def hash_password(password: str) -> str:
+    return await _submit("password.hash", _hash, password)
+
+
+async def verify_password(password: str, password_hash: str):
+    """(ok, new_hash): new_hash khác None thì cần ghi lại vào DB."""
+    ok, new_hash = await _submit("password.verify", _verify, password, password_hash)
+    if new_hash:
+        metrics.incr("password.rehashed")
+    return ok, new_hash
+
+
+def check_rate_limit(email: str, ip: Optional[str]):
+    """Giới hạn số lần login/register theo email và IP (raise 429)."""
+    wait = _email_limiter.hit(email.strip().lower())
+    if not wait and ip:
+        wait = _ip_limiter.hit(ip)
+    if wait:
+        metrics.incr("password.rate_limited")
+        raise HTTPException(status_code=429, detail="Too many attempts",
+                            headers={"Retry-After": str(int(wait) + 1)})
+
+
+def queue_depth() -> int:
+    return _pending
+
+
+# /admin/metrics: số hash/verify đang chờ so với HASH_QUEUE_LIMIT (đầy => 503)
+metrics.gauge("password.queue_depth", queue_depth)
+metrics.gauge("password.queue_limit", lambda: HASH_QUEUE_LIMIT)
+
+
+# ---------------------------
+# Calibration
+def calibrate(target_ms: float, repeat: int = 5, probe_rounds: int = 10000) -> int:
+    """Đo thời gian hash trên máy hiện tại, trả về số vòng đạt ~target_ms."""
+    def measure(rounds: int) -> float:
+        ctx = make_context(rounds)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ctx.hash("calibration-password")
+            samples.append(time.perf_counter() - start)
+        return sorted(samples)[len(samples) // 2] * 1000
+
+    per_round = measure(probe_rounds) / probe_rounds
+    rounds = int(target_ms / per_round)
+    # đo lại ở số vòng ước lượng để bù phần chi phí cố định
+    per_round = measure(rounds) / rounds
+    rounds = int(target_ms / per_round)
+    return max(1000, round(rounds, -3))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibrate pbkdf2_sha256 rounds for this host")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="target hashing latency per password")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rounds = calibrate(args.target_ms, args.repeat)
+    start = time.perf_counter()
+    make_context(rounds).hash("calibration-password")
+    print(f"hash at {rounds} rounds: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"(current PBKDF2_ROUNDS={PBKDF2_ROUNDS})")
+    print(f"PBKDF2_ROUNDS={rounds}")
@@ -0,0 +1,238 @@
+# profiler.py - sampling profiler nhẹ, bật/tắt theo request
+import os
+import sys
+import time
+import random
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+from starlette.routing import Match
+
+SAMPLE_INTERVAL = float(os.environ.get("PROFILER_INTERVAL_MS", "5")) / 1000
+PROFILE_HEADER = b"x-profile"
+MAX_STACK_DEPTH = 64
+
+# endpoint của request đang được lấy mẫu (None nếu request không được chọn)
+_current_endpoint: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profiled_endpoint", default=None)
+
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Lấy mẫu stack của các thread đang chạy endpoint được chọn.
+
+    Chỉ walk stack khi có ít nhất một request được lấy mẫu đang chạy, nên lúc
+    không có request nào chi phí gần như bằng 0. Stack được gộp theo endpoint
+    ở dạng "folded" (a;b;c count) để vẽ flame graph.
+    Một request được lấy mẫu nếu có header X-Profile hoặc rơi vào sample_rate %.
+    Thread trong threadpool (run_in_threadpool bên dưới) không có frame của
+    endpoint trên stack, nên được gắn với endpoint qua map thread ident ->
+    endpoint; thời gian chờ process pool (hash mật khẩu) được cộng riêng.
+    Lưu ý: request không được chọn của cùng endpoint chạy song song cũng có
+    thể bị lấy mẫu - đây là profiler thống kê, không phải tracer.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.enabled = False
+        self.sample_rate = 0.0
+        self._app = None
+        self._endpoint_codes: Dict = {}
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._stacks = defaultdict(Counter)
+        self._threads: Dict[int, str] = {}
+        self._offloaded = defaultdict(lambda: defaultdict(lambda: {"count": 0, "seconds": 0.0}))
+        self._samples = 0
+        self._profiled_requests = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def attach(self, app):
+        self._app = app
+
+    def configure(self, enabled: bool, sample_rate: float):
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        if enabled:
+            self._load_endpoints()
+            self._ensure_thread()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._offloaded.clear()
+            self._samples = 0
+            self._profiled_requests = 0
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "samples": self._samples,
+                "profiled_requests": self._profiled_requests,
+                "endpoints": sorted(self._stacks),
+                # thời gian chờ ngoài process (vd "process_pool:password.verify"), không có trong stacks
+                "offloaded": {ep: {k: dict(v) for k, v in kinds.items()} for ep, kinds in self._offloaded.items()},
+            }
+
+    def folded(self, endpoint: Optional[str] = None) -> str:
+        with self._lock:
+            lines = []
+            for ep, stacks in self._stacks.items():
+                if endpoint and ep != endpoint:
+                    continue
+                for stack, count in stacks.most_common():
+                    lines.append(f"{ep};{stack} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    # ---------------------------
+    # Request hooks
+    def should_sample(self, headers) -> bool:
+        if not self.enabled:
+            return False
+        if any(k == PROFILE_HEADER for k, _ in headers):
+            return True
+        return self.sample_rate > 0 and random.random() * 100 < self.sample_rate
+
+    def request_started(self):
+        with self._lock:
+            self._inflight += 1
+            self._profiled_requests += 1
+        self._wakeup.set()
+
+    def request_finished(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def endpoint_label(self, scope) -> Optional[str]:
+        for route in getattr(self._app, "routes", []):
+            if not hasattr(route, "path"):
+                continue
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{','.join(sorted(getattr(route, 'methods', None) or []))} {route.path}"
+        return None
+
+    def bind(self, fn):
+        """Gói fn để thread chạy nó được tính cho endpoint đang lấy mẫu (nếu có)."""
+        endpoint = _current_endpoint.get()
+        if endpoint is None:
+            return fn
+
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            with self._lock:
+                previous = self._threads.get(ident)
+                self._threads[ident] = endpoint
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    if previous is None:
+                        self._threads.pop(ident, None)
+                    else:
+                        self._threads[ident] = previous
+        return run
+
+    def record_offloaded(self, kind: str, seconds: float):
+        """Thời gian request chờ việc chạy ở process khác (stack không lấy mẫu được)."""
+        endpoint = _current_endpoint.get()
+        if endpoint is None:
+            return
+        with self._lock:
+            entry = self._offloaded[endpoint][kind]
+            entry["count"] += 1
+            entry["seconds"] += seconds
+
+    # ---------------------------
+    # Sampler
+    def _load_endpoints(self):
+        codes = {}
+        for route in getattr(self._app, "routes", []):
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is not None:
+                codes[code] = f"{','.join(sorted(getattr(route, 'methods', None) or []))} {route.path}"
+        self._endpoint_codes = codes
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while self.enabled:
+            if self._inflight <= 0:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            self._sample(me)
+            time.sleep(self.interval)
+
+    def _sample(self, own_ident: int):
+        collected = []
+        with self._lock:
+            threads = dict(self._threads)
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            endpoint = None
+            f = frame
+            while f is not None and len(stack) < MAX_STACK_DEPTH:
+                endpoint = self._endpoint_codes.get(f.f_code)
+                stack.append(_frame_label(f.f_code))
+                if endpoint:
+                    break
+                f = f.f_back
+            endpoint = endpoint or threads.get(ident)
+            if endpoint:
+                collected.append((endpoint, ";".join(reversed(stack))))
+        if not collected:
+            return
+        with self._lock:
+            for endpoint, stack in collected:
+                self._stacks[endpoint][stack] += 1
+                self._samples += 1
+
+
+profiler = SamplingProfiler()
+
+
+class ProfilerMiddleware:
+    """ASGI middleware: đánh dấu request được lấy mẫu cho profiler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.should_sample(scope.get("headers", [])):
+            await self.app(scope, receive, send)
+            return
+        profiler.request_started()
+        token = _current_endpoint.set(profiler.endpoint_label(scope) or scope.get("path", "?"))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_endpoint.reset(token)
+            profiler.request_finished()
+
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    """Như fastapi.concurrency.run_in_threadpool, nhưng thread worker được lấy
+    mẫu cho endpoint của request hiện tại."""
+    return await _run_in_threadpool(profiler.bind(fn), *args, **kwargs)
+
+
+def install_profiler(app):
+    profiler.attach(app)
+    app.add_middleware(ProfilerMiddleware)
@@ -2,6 +2,8 @@
 import json
 from datetime import datetime, timedelta
 
+from itinerary_patch import current_slot
+
 def build_prompt(payload: dict) -> str:
     # Tính số ngày
     start = datetime.fromisoformat(payload["start_date"])
@@ -53,6 +55,28 @@ Return ONLY a valid JSON object:
     return template.strip()
 
 
+def build_slot_prompt(payload: dict, day: dict, slot: str, hint: str = None) -> str:
+    # Prompt ngắn để sinh lại đúng một slot: chỉ gửi ngày đó làm ngữ cảnh
+    others = {k: v.get("title") for k, v in day.items() if k not in ("date", slot) and isinstance(v, dict)}
+    current = current_slot(day, slot).get("title")
+    template = f"""
+You are an intelligent travel planning AI.
+Suggest a replacement {slot} activity in {payload['destination']} on {day.get('date')}.
+
+Interests: {", ".join(payload['interests'])}
+Travel pace: {payload['pace']}
+Other activities that day: {json.dumps(others, ensure_ascii=False)}
+Current {slot} activity (do not repeat it): {current}
+{f"Traveller request: {hint}" if hint else ""}
+
+✅ Output format requirement:
+Return ONLY a valid JSON object:
+{{"time": "short string", "title": "short string", "explain": "one sentence"}}
+"""
+
+    return template.strip()
+
+
 def parse_model_output(text: str):
     # LLM sometimes wraps JSON inside text -> extract block
     try:
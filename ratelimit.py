@@ -0,0 +1,29 @@
+# ratelimit.py - rate limit cửa sổ cố định, trong bộ nhớ của worker
+import time
+import threading
+
+
+class RateLimiter:
+    """Cho phép tối đa `limit` lần / `window` giây cho mỗi key."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + window
+
+    def hit(self, key: str) -> float:
+        """Ghi nhận 1 lần gọi; trả về 0 nếu được phép, ngược lại số giây cần chờ."""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_purge:
+                self._hits = {k: v for k, v in self._hits.items() if v[0] > now}
+                self._next_purge = now + self.window
+            reset_at, count = self._hits.get(key, (0.0, 0))
+            if reset_at <= now:
+                reset_at, count = now + self.window, 0
+            if count >= self.limit:
+                return reset_at - now
+            self._hits[key] = (reset_at, count + 1)
+            return 0.0
@@ -0,0 +1,165 @@
+# replay.py - phát lại log traffic JSONL (request_log.py) vào server đang chạy
+#
+#   python replay.py logs/traffic.jsonl* --url http://localhost:8000 \
+#       --email bench@example.com --password secret --speed 4
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+REPLAYABLE = ("/generate", "/generate/stream", "/generate/batch")
+
+
+def load_records(paths):
+    """Đọc các file log (kể cả bản xoay vòng .1, .2...) và sắp theo thời gian."""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("endpoint") in REPLAYABLE and "ts" in rec:
+                    records.append(rec)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Replayer:
+    def __init__(self, url: str, token: str, concurrency: int, timeout: float,
+                 refresh_token: Optional[str] = None):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.token = token
+        self.refresh_token = refresh_token
+        self.auth_lock = threading.Lock()
+        self.refreshes = 0
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.lag = []
+
+    def _refresh(self, stale: str) -> bool:
+        """Access token hết hạn giữa lần replay dài: đổi bằng refresh token.
+
+        Refresh token bị xoay vòng (dùng lại token cũ => server thu hồi mọi
+        session), nên nhiều thread cùng gặp 401 chỉ refresh một lần.
+        """
+        with self.auth_lock:
+            if self.token != stale:
+                return True  # thread khác vừa refresh
+            if not self.refresh_token:
+                return False
+            r = requests.post(self.url + "/token/refresh", json={"refresh_token": self.refresh_token}, timeout=30)
+            if r.status_code != 200:
+                return False
+            tokens = r.json()
+            self.token, self.refresh_token = tokens["access_token"], tokens["refresh_token"]
+            self.refreshes += 1
+            return True
+
+    def _post(self, rec, body, token):
+        return self.session.post(self.url + rec["endpoint"], json=body, headers={"Authorization": f"Bearer {token}"},
+                                 timeout=self.timeout, stream=rec["endpoint"].endswith("/stream"))
+
+    def send(self, rec, scheduled_at):
+        start = time.perf_counter()
+        lag = start - scheduled_at
+        try:
+            body = rec["request"]["items"] if rec["endpoint"] == "/generate/batch" else rec["request"]
+            token = self.token
+            r = self._post(rec, body, token)
+            if r.status_code == 401 and self._refresh(token):
+                r.close()
+                r = self._post(rec, body, self.token)
+            for _ in r.iter_content(chunk_size=None):
+                pass
+            status = r.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.lag.append(lag)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def login(url: str, email: str, password: str) -> dict:
+    r = requests.post(url.rstrip("/") + "/login", json={"email": email, "password": password}, timeout=30)
+    r.raise_for_status()
+    return r.json()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded /generate traffic against a server")
+    parser.add_argument("logs", nargs="+", help="JSONL traffic logs written by request_log.py")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", help="bearer token (or use --email/--password)")
+    parser.add_argument("--refresh-token", help="used with --token to renew it when it expires mid-replay")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor: 2 = twice the original rate")
+    parser.add_argument("--concurrency", type=int, default=64, help="max in-flight requests")
+    parser.add_argument("--limit", type=int, help="replay at most N records")
+    parser.add_argument("--timeout", type=float, default=200.0)
+    args = parser.parse_args(argv)
+
+    records = load_records(args.logs)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("no replayable records found", file=sys.stderr)
+        return 1
+    if args.token:
+        token, refresh_token = args.token, args.refresh_token
+    else:
+        tokens = login(args.url, args.email, args.password)
+        token, refresh_token = tokens["access_token"], tokens.get("refresh_token")
+
+    replayer = Replayer(args.url, token, args.concurrency, args.timeout, refresh_token)
+    t0 = records[0]["ts"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for rec in records:
+            scheduled_at = start + (rec["ts"] - t0) / args.speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(replayer.send, rec, scheduled_at)
+    wall = time.perf_counter() - start
+
+    span = (records[-1]["ts"] - t0) or 1e-9
+    lat = replayer.latencies
+    print(f"replayed {len(records)} requests in {wall:.1f}s "
+          f"(recorded rate {len(records) / span:.2f} rps, x{args.speed} => target {len(records) / span * args.speed:.2f} rps, "
+          f"achieved {len(records) / wall:.2f} rps)")
+    print(f"statuses: {replayer.statuses} (token refreshes: {replayer.refreshes})")
+    print(f"latency ms: p50={percentile(lat, .5) * 1000:.1f} p95={percentile(lat, .95) * 1000:.1f} "
+          f"p99={percentile(lat, .99) * 1000:.1f} max={max(lat) * 1000:.1f}")
+    print(f"dispatch lag ms: p99={percentile(replayer.lag, .99) * 1000:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
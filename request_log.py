@@ -0,0 +1,82 @@
+# request_log.py - ghi mẫu ItineraryRequest ra JSONL (xoay vòng, ghi nền) để replay
+import os
+import json
+import time
+import queue
+import random
+import logging
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from fastapi import HTTPException
+
+REQUEST_LOG_PATH = os.environ.get("REQUEST_LOG_PATH", os.path.join("logs", "traffic.jsonl"))
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get("REQUEST_LOG_SAMPLE_RATE", "0"))  # % request được ghi
+REQUEST_LOG_MAX_BYTES = int(os.environ.get("REQUEST_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+REQUEST_LOG_BACKUPS = int(os.environ.get("REQUEST_LOG_BACKUPS", "5"))
+
+_logger = logging.getLogger("trip.traffic")
+_logger.propagate = False
+_listener = None
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Hàng đợi đầy thì bỏ bản ghi thay vì chặn request."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def start():
+    """Bật ghi log (gọi lúc startup). Ghi file do một thread nền đảm nhận."""
+    global _listener
+    if _listener is not None or REQUEST_LOG_SAMPLE_RATE <= 0:
+        return
+    directory = os.path.dirname(REQUEST_LOG_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = RotatingFileHandler(REQUEST_LOG_PATH, maxBytes=REQUEST_LOG_MAX_BYTES,
+                                       backupCount=REQUEST_LOG_BACKUPS, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    q = queue.Queue(maxsize=10000)
+    _logger.addHandler(_DroppingQueueHandler(q))
+    _logger.setLevel(logging.INFO)
+    _listener = QueueListener(q, file_handler)
+    _listener.start()
+
+
+def stop():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+@contextmanager
+def record(endpoint: str, body: dict):
+    """Đo thời gian xử lý và ghi 1 dòng JSONL nếu request được lấy mẫu."""
+    if _listener is None or random.random() * 100 >= REQUEST_LOG_SAMPLE_RATE:
+        yield
+        return
+    ts = time.time()
+    start_t = time.perf_counter()
+    status = 200
+    try:
+        yield
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except Exception:
+        status = 500
+        raise
+    finally:
+        _logger.info(json.dumps({
+            "ts": round(ts, 3),
+            "endpoint": endpoint,
+            "request": body,
+            "duration_ms": round((time.perf_counter() - start_t) * 1000, 2),
+            "status": status,
+        }, ensure_ascii=False))
@@ -0,0 +1,60 @@
+# scheduler.py - giới hạn số generation chạy đồng thời, ưu tiên việc ngắn (SJF)
+#
+# Khi hết slot, request chờ được xếp theo cost ước lượng (token) trừ đi phần
+# "aging" theo thời gian chờ: việc ngắn đi trước, nhưng việc dài chờ đủ lâu
+# cũng sẽ tới lượt (không bị bỏ đói).
+import os
+import time
+import threading
+from typing import Callable, Optional
+
+# Chờ 1 giây ~ giảm AGING_TOKENS_PER_SEC token cost: 30 ngày (~2400 token)
+# chờ ~ 20s thì ngang một request 1 ngày vừa tới
+AGING_TOKENS_PER_SEC = float(os.environ.get("SCHEDULER_AGING_TOKENS_PER_SEC", "120"))
+POLL_INTERVAL = 0.05
+
+
+class _Waiter:
+    __slots__ = ("cost", "enqueued")
+
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.enqueued = time.monotonic()
+
+
+class SjfScheduler:
+    def __init__(self, slots: int, aging: float = AGING_TOKENS_PER_SEC):
+        self._cond = threading.Condition()
+        self._free = slots
+        self._aging = aging
+        self._waiting = []
+
+    def _next(self) -> _Waiter:
+        now = time.monotonic()
+        return min(self._waiting, key=lambda w: w.cost - self._aging * (now - w.enqueued))
+
+    def acquire(self, cost: float, check: Optional[Callable[[], None]] = None) -> float:
+        """Chờ tới lượt; trả về số giây đã chờ. `check()` được gọi định kỳ
+        trong lúc chờ và có thể raise để bỏ hàng đợi (huỷ / quá deadline)."""
+        waiter = _Waiter(cost)
+        with self._cond:
+            self._waiting.append(waiter)
+            try:
+                while not (self._free > 0 and self._next() is waiter):
+                    self._cond.wait(POLL_INTERVAL)
+                    if check is not None:
+                        check()
+                self._free -= 1
+            finally:
+                self._waiting.remove(waiter)
+                self._cond.notify_all()
+        return time.monotonic() - waiter.enqueued
+
+    def release(self):
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._waiting)
@@ -2,8 +2,11 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import List
+from datetime import date
 import uvicorn
 
+from itinerary_builder import build_days
+
 app = FastAPI()
 
 class GenerateRequest(BaseModel):
@@ -18,27 +21,9 @@ class GenerateRequest(BaseModel):
 async def generate(req: GenerateRequest):
     # For development: return deterministic mock based on input
     try:
-        days = []
-        # Example: create one day per date (basic mock)
-        days.append({
-            "date": req.start_date,
-            "morning": {
-                "title": "Explore local market",
-                "time": "09:00-11:00",
-                "explain": "Great for food and local vibe."
-            },
-            "afternoon": {
-                "title": "City museum",
-                "time": "13:00-15:00",
-                "explain": "Typical museum for history."
-            },
-            "evening": {
-                "title": "Nightlife district",
-                "time": "19:00-22:00",
-                "explain": "Bars and street food."
-            }
-        })
-        return {"days": days}
+        start = date.fromisoformat(req.start_date)
+        end = date.fromisoformat(req.end_date)
+        return {"days": build_days(start, end, req.interests, req.pace)}
     except Exception as e:
         return {"error": str(e)}
 
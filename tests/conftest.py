@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """DB tạm đã migrate tới version mới nhất."""
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(db, "DB_FILE", path)
+    migrations.migrate(verbose=False)
+    return path
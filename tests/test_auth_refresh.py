@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import issue_session, refresh_session, revoke_refresh_token, verify_token  # noqa: E402
+from db import create_user  # noqa: E402
+
+
+def new_user(email="a@example.com"):
+    return create_user(email, "hash")
+
+
+def test_refresh_rotates_token(db_file):
+    user_id = new_user()
+    session = issue_session(user_id)
+    assert verify_token(session["access_token"]) == user_id
+
+    rotated = refresh_session(session["refresh_token"])
+    assert rotated["user_id"] == user_id
+    assert rotated["refresh_token"] != session["refresh_token"]
+    assert verify_token(rotated["access_token"]) == user_id
+    # token mới dùng tiếp được
+    assert refresh_session(rotated["refresh_token"]) is not None
+
+
+def test_reused_refresh_token_revokes_all_sessions(db_file):
+    user_id = new_user()
+    other_device = issue_session(user_id)
+    stolen = issue_session(user_id)
+    rotated = refresh_session(stolen["refresh_token"])
+
+    # token cũ bị dùng lại => coi như bị lộ
+    assert refresh_session(stolen["refresh_token"]) is None
+    assert refresh_session(rotated["refresh_token"]) is None
+    assert refresh_session(other_device["refresh_token"]) is None
+
+
+def test_reuse_does_not_touch_other_users(db_file):
+    victim = new_user("a@example.com")
+    bystander = issue_session(new_user("b@example.com"))
+    stolen = issue_session(victim)
+    refresh_session(stolen["refresh_token"])
+    assert refresh_session(stolen["refresh_token"]) is None
+    assert refresh_session(bystander["refresh_token"]) is not None
+
+
+def test_revoked_and_unknown_tokens_rejected(db_file):
+    session = issue_session(new_user())
+    assert revoke_refresh_token(session["refresh_token"])
+    assert refresh_session(session["refresh_token"]) is None
+    assert refresh_session("not-a-token") is None
@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from auth import issue_session  # noqa: E402
+from db import create_user, get_history_entry, save_history_entry  # noqa: E402
+
+REQUEST = {"origin": "a", "destination": "b", "start_date": "2025-01-01", "end_date": "2025-01-01",
+           "interests": ["food"], "pace": "normal"}
+
+
+def slot(title, time="09:00"):
+    return {"time": time, "title": title, "explain": ""}
+
+
+def day(morning="Market"):
+    return {"date": "2025-01-01", "morning": slot(morning), "afternoon": slot("Museum"), "evening": slot("Dinner")}
+
+
+@pytest.fixture
+def api(db_file):
+    user_id = create_user("a@example.com", "hash")
+    client = TestClient(main.app)
+    client.headers["Authorization"] = "Bearer " + issue_session(user_id)["access_token"]
+    client.user_id = user_id
+    return client
+
+
+@pytest.mark.parametrize("days", [
+    [],
+    ["free day"],
+    [{"date": "2025-01-01", "morning": slot("x"), "afternoon": slot("y")}],
+    [{**day(), "evening": "Dinner"}],
+    [{**day(), "evening": {"time": "19:00", "explain": ""}}],
+    [{**day(), "evening": slot("")}],
+])
+def test_new_version_rejects_malformed_days(api, days):
+    entry = save_history_entry(api.user_id, REQUEST, {"days": [day()]})
+    r = api.post(f"/history/{entry['id']}/versions", json={"days": days})
+    assert r.status_code == 422
+    assert get_history_entry(api.user_id, entry["id"])["response"] == {"days": [day()]}
+
+
+def test_new_version_keeps_extra_fields(api):
+    entry = save_history_entry(api.user_id, REQUEST, {"days": [day()]})
+    revised = {**day("Beach"), "note": "rain"}
+    r = api.post(f"/history/{entry['id']}/versions", json={"days": [revised]})
+    assert r.status_code == 200
+    assert r.json()["version"] == 2
+    assert get_history_entry(api.user_id, entry["id"])["response"] == {"days": [revised]}
+
+
+def test_edit_slot_over_legacy_string_slot(api):
+    entry = save_history_entry(api.user_id, REQUEST, {"days": [{**day(), "morning": "Beach", "evening": None}]})
+    for name in ("morning", "evening"):
+        r = api.put(f"/history/{entry['id']}/days/0/{name}", json={"title": "Park", "time": "10:00"})
+        assert r.status_code == 200
+    saved = get_history_entry(api.user_id, entry["id"])["response"]["days"][0]
+    assert saved["morning"] == saved["evening"] == {"time": "10:00", "title": "Park", "explain": ""}
+
+
+def test_edit_slot_on_day_without_slots(api):
+    entry = save_history_entry(api.user_id, REQUEST, {"days": ["free day"]})
+    r = api.put(f"/history/{entry['id']}/days/0/morning", json={"title": "Park"})
+    assert r.status_code == 400
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import idempotency  # noqa: E402
+from idempotency import run_idempotent  # noqa: E402
+
+BODY = {"origin": "a", "destination": "b"}
+
+
+class Handler:
+    """compute() đếm số lần chạy; trả lần lượt các status trong `statuses`."""
+
+    def __init__(self, *statuses, delay=0.0):
+        self.statuses = list(statuses) or [200]
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        status = self.statuses[min(self.calls, len(self.statuses)) - 1]
+        return Response(content=f'{{"n": {self.calls}}}'.encode(), status_code=status,
+                        media_type="application/json")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_same_key_runs_once(db_file):
+    handler = Handler(delay=0.3)
+
+    async def both():
+        return await asyncio.gather(run_idempotent("t", "k", BODY, handler),
+                                    run_idempotent("t", "k", BODY, handler))
+
+    first, second = run(both())
+    assert handler.calls == 1
+    assert first.body == second.body == b'{"n": 1}'
+    # request thứ hai chờ request gốc rồi nhận lại kết quả đã lưu
+    assert {first.headers.get("Idempotent-Replayed"), second.headers.get("Idempotent-Replayed")} == {"true", None}
+    assert not idempotency._inflight
+
+
+def test_completed_key_replays_stored_response(db_file):
+    handler = Handler()
+    run(run_idempotent("t", "k", BODY, handler))
+    replayed = run(run_idempotent("t", "k", BODY, handler))
+    assert handler.calls == 1
+    assert replayed.status_code == 200
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.body == b'{"n": 1}'
+
+
+@pytest.mark.parametrize("status", [400, 500, 503])
+def test_key_released_after_error_response(db_file, status):
+    handler = Handler(status, 200)
+    assert run(run_idempotent("t", "k", BODY, handler)).status_code == status
+    retried = run(run_idempotent("t", "k", BODY, handler))
+    assert handler.calls == 2
+    assert retried.status_code == 200
+    assert "Idempotent-Replayed" not in retried.headers
+
+
+def test_key_released_after_exception(db_file):
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        raise HTTPException(status_code=502, detail="backend down")
+
+    with pytest.raises(HTTPException):
+        run(run_idempotent("t", "k", BODY, failing))
+    handler = Handler()
+    assert run(run_idempotent("t", "k", BODY, handler)).status_code == 200
+    assert handler.calls == 1
+
+
+def test_same_key_different_body_is_rejected(db_file):
+    run(run_idempotent("t", "k", BODY, Handler()))
+    with pytest.raises(HTTPException) as e:
+        run(run_idempotent("t", "k", {**BODY, "destination": "c"}, Handler()))
+    assert e.value.status_code == 422
+
+
+def test_keys_are_scoped(db_file):
+    handler = Handler()
+    run(run_idempotent("user:1", "k", BODY, handler))
+    run(run_idempotent("user:2", "k", BODY, handler))
+    assert handler.calls == 2
+
+
+def stream_handler(lines, calls):
+    async def compute():
+        calls.append(1)
+
+        async def body():
+            for line in lines:
+                yield line
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+    return compute
+
+
+async def consume(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def completed(body):
+    return body if body.endswith(b"done\n") else None
+
+
+def test_stream_stored_only_when_complete(db_file):
+    calls = []
+
+    async def scenario(lines):
+        response = await run_idempotent("t", "s", BODY, stream_handler(lines, calls), save_stream=completed)
+        if isinstance(response, StreamingResponse):
+            return await consume(response)
+        return response.body
+
+    assert run(scenario([b"day\n", b"error\n"])) == b"day\nerror\n"
+    assert run(scenario([b"day\n", b"done\n"])) == b"day\ndone\n"
+    assert run(scenario([b"other\n"])) == b"day\ndone\n"
+    assert len(calls) == 2
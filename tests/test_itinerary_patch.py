@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from itinerary_patch import apply_patch, check_slot, current_slot, diff_itinerary, slot_patch  # noqa: E402
+
+
+def day(date, morning="Market", afternoon="Museum", evening="Dinner"):
+    return {
+        "date": date,
+        "morning": {"time": "09:00", "title": morning, "explain": ""},
+        "afternoon": {"time": "14:00", "title": afternoon, "explain": ""},
+        "evening": {"time": "19:00", "title": evening, "explain": ""},
+    }
+
+
+BASE = {"days": [day("2025-01-01"), day("2025-01-02"), day("2025-01-03")]}
+
+
+@pytest.mark.parametrize("new", [
+    BASE,
+    {"days": [day("2025-01-01"), day("2025-01-02", evening="Night market"), day("2025-01-03")]},
+    {"days": [day("2025-01-01"), day("2025-01-02")]},
+    {"days": BASE["days"] + [day("2025-01-04"), day("2025-01-05")]},
+    {"days": []},
+    {"days": [{"date": "2025-01-01", "a/b": 1, "c~d": {"x": "y"}, "~1": 2}]},
+    {"days": [day("2025-01-01")], "degraded": True, "note/x": "~"},
+    {"days": ["free day", day("2025-01-02"), None]},
+])
+def test_diff_apply_round_trip(new):
+    ops = diff_itinerary(BASE, new)
+    assert apply_patch(BASE, ops) == new
+    # và ngược lại
+    assert apply_patch(new, diff_itinerary(new, BASE)) == BASE
+
+
+def test_diff_identical_is_empty():
+    assert diff_itinerary(BASE, BASE) == []
+
+
+def test_diff_only_changed_slot():
+    new = {"days": [day("2025-01-01"), day("2025-01-02", afternoon="Park"), day("2025-01-03")]}
+    assert diff_itinerary(BASE, new) == [
+        {"op": "replace", "path": "/days/1/afternoon", "value": new["days"][1]["afternoon"]},
+    ]
+
+
+def test_diff_escapes_pointer_segments():
+    new = {"days": [{"date": "x", "a/b": 1, "t~": 2}]}
+    paths = [op["path"] for op in diff_itinerary({"days": [{"date": "x"}]}, new)]
+    assert sorted(paths) == ["/days/0/a~1b", "/days/0/t~0"]
+
+
+def test_apply_does_not_mutate_input():
+    ops = slot_patch(0, "morning", {"time": "08:00", "title": "Beach", "explain": ""})
+    out = apply_patch(BASE, ops)
+    assert out["days"][0]["morning"]["title"] == "Beach"
+    assert BASE["days"][0]["morning"]["title"] == "Market"
+
+
+def test_apply_missing_path_raises_value_error():
+    with pytest.raises(ValueError):
+        apply_patch(BASE, slot_patch(5, "morning", {"title": "x"}))
+    with pytest.raises(ValueError):
+        apply_patch(BASE, [{"op": "replace", "path": "/days/0/nope", "value": 1}])
+
+
+def test_check_slot_rejects_day_without_slots():
+    check_slot(BASE, 0, "morning")
+    with pytest.raises(ValueError):
+        check_slot({"days": ["free day"]}, 0, "morning")
+    with pytest.raises(ValueError):
+        check_slot(BASE, 0, "night")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ({"time": "09:00", "title": "Market"}, {"time": "09:00", "title": "Market"}),
+    ("Beach", {"title": "Beach"}),
+    (None, {}),
+    (3, {}),
+])
+def test_current_slot(value, expected):
+    assert current_slot({"morning": value}, "morning") == expected
+    assert current_slot({}, "evening") == {}
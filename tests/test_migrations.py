@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+from itinerary_patch import slot_patch  # noqa: E402
+
+# Schema do init_db() tạo trước khi có migrations.py (user_version = 0)
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL, created_at TEXT);
+CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                      request_json TEXT NOT NULL, response_json TEXT NOT NULL, created_at TEXT);
+CREATE TABLE sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                       token_hash BLOB UNIQUE NOT NULL, expires_at INTEGER NOT NULL,
+                       revoked INTEGER NOT NULL DEFAULT 0, created_at TEXT);
+CREATE TABLE history_patches (id INTEGER PRIMARY KEY AUTOINCREMENT, history_id INTEGER NOT NULL,
+                              patch_json TEXT NOT NULL, created_at TEXT);
+CREATE TABLE history_revisions (user_id INTEGER PRIMARY KEY, revision INTEGER NOT NULL);
+"""
+
+
+def slot(title):
+    return {"time": "09:00", "title": title, "explain": ""}
+
+
+def itinerary(n):
+    return {"days": [{"date": "2025-01-01", "morning": slot(f"m{n}"), "afternoon": slot("a"), "evening": slot("e")}]}
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """DB cũ: 5 itinerary, itinerary i có i patch sửa buổi sáng (history_patches)."""
+    path = str(tmp_path / "legacy.db")
+    monkeypatch.setattr(db, "DB_FILE", path)
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO users (email, password_hash) VALUES ('a@example.com', 'hash')")
+    for i in range(5):
+        conn.execute("INSERT INTO history (user_id, request_json, response_json, created_at) VALUES (1, '{}', ?, 't')",
+                     (json.dumps(itinerary(i)),))
+        for k in range(i):
+            conn.execute("INSERT INTO history_patches (history_id, patch_json, created_at) VALUES (?, ?, 't')",
+                         (i + 1, json.dumps(slot_patch(0, "morning", slot(f"m{i}-edit{k}")))))
+    # patch không áp được: bị bỏ qua
+    conn.execute("INSERT INTO history_patches (history_id, patch_json, created_at) VALUES (2, ?, 't')",
+                 (json.dumps(slot_patch(9, "morning", slot("x"))),))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def user_version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def table_exists(path, name):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def assert_folded():
+    for i in range(5):
+        entry = db.get_history_entry(1, i + 1)
+        expected = f"m{i}-edit{i - 1}" if i else f"m{i}"
+        assert entry["response"]["days"][0]["morning"]["title"] == expected
+        assert entry["version"] == i + 1
+        assert [v["version"] for v in db.list_history_versions(1, i + 1)] == list(range(1, i + 2))
+        # version cũ vẫn đọc lại được
+        assert db.get_history_entry(1, i + 1, version=1)["response"] == itinerary(i)
+
+
+def test_migrate_pre_versioning_db(legacy_db, monkeypatch):
+    monkeypatch.setattr(migrations, "FOLD_BATCH_SIZE", 2)  # nhiều lô
+    assert user_version(legacy_db) == 0
+    assert migrations.migrate(verbose=False) == migrations.SCHEMA_VERSION
+    assert user_version(legacy_db) == migrations.SCHEMA_VERSION
+    assert not table_exists(legacy_db, "history_patches")
+    assert_folded()
+    migrations.check_schema()
+    # chạy lại: không làm gì
+    assert migrations.migrate(verbose=False) == migrations.SCHEMA_VERSION
+    assert_folded()
+
+
+def test_interrupted_batched_migration_resumes(legacy_db, monkeypatch):
+    monkeypatch.setattr(migrations, "FOLD_BATCH_SIZE", 2)
+    fold = migrations._fold_patch_batch
+    calls = []
+
+    def flaky(c, batch_size):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+        return fold(c, batch_size)
+
+    monkeypatch.setattr(migrations, "_fold_patch_batch", flaky)
+    with pytest.raises(RuntimeError):
+        migrations.migrate(verbose=False)
+    # lô đầu đã commit, version chưa tăng
+    assert user_version(legacy_db) == 5
+    assert table_exists(legacy_db, "history_patches")
+
+    monkeypatch.setattr(migrations, "_fold_patch_batch", fold)
+    assert migrations.migrate(verbose=False) == migrations.SCHEMA_VERSION
+    assert_folded()
+
+
+def test_backfill_inside_batched_migration(db_file, monkeypatch):
+    conn = sqlite3.connect(db_file)
+    conn.executemany("INSERT INTO history (user_id, request_json, response_json) VALUES (1, '{}', ?)",
+                     [(json.dumps(itinerary(i)),) for i in range(25)])
+    conn.commit()
+    conn.close()
+    updated = []
+
+    @migrations.batched
+    def add_num_days(c):
+        c.execute("ALTER TABLE history ADD COLUMN num_days INTEGER")
+        updated.append(migrations.backfill(c, "history", "num_days = json_array_length(response_json, '$.days')",
+                                           "num_days IS NULL", batch_size=10, pause=0))
+
+    target = migrations.SCHEMA_VERSION + 1
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(target, "num_days", add_num_days)])
+    assert migrations.migrate(target, verbose=False) == target
+    assert updated == [25]
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM history WHERE num_days = 1").fetchone()[0] == 25
+    conn.close()
+    assert user_version(db_file) == target
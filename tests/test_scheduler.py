@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import SjfScheduler  # noqa: E402
+
+
+class Cancelled(Exception):
+    pass
+
+
+def wait_for(cond, timeout=5.0):
+    until = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < until, "timed out"
+        time.sleep(0.01)
+
+
+def enqueue(sched, cost, order, check=None):
+    """Thread chờ slot với `cost`; có slot thì ghi lại cost rồi trả slot."""
+    def worker():
+        try:
+            sched.acquire(cost, check)
+        except Cancelled:
+            order.append(("cancelled", cost))
+            return
+        order.append(cost)
+        sched.release()
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    return t
+
+
+def run_queue(sched, costs, gap=0.0):
+    """Giữ slot duy nhất, xếp hàng `costs` (cách nhau `gap` giây) rồi thả ra."""
+    sched.acquire(0)
+    order = []
+    threads = []
+    for i, cost in enumerate(costs):
+        threads.append(enqueue(sched, cost, order))
+        wait_for(lambda: sched.pending() == i + 1)
+        time.sleep(gap)
+    sched.release()
+    for t in threads:
+        t.join(5)
+    return order
+
+
+def test_shortest_job_first():
+    assert run_queue(SjfScheduler(1, aging=0), [300, 100, 200, 50]) == [50, 100, 200, 300]
+
+
+def test_aging_lets_long_job_overtake():
+    # chờ 0.3s * 10000 token/s >> chênh lệch cost: việc dài tới trước đi trước
+    assert run_queue(SjfScheduler(1, aging=10000), [1000, 10], gap=0.3) == [1000, 10]
+    # không aging: việc ngắn luôn đi trước
+    assert run_queue(SjfScheduler(1, aging=0), [1000, 10], gap=0.3) == [10, 1000]
+
+
+def test_returns_waited_seconds():
+    sched = SjfScheduler(1)
+    assert sched.acquire(10) < 0.05
+    threading.Timer(0.2, sched.release).start()
+    assert sched.acquire(10) >= 0.15
+    sched.release()
+
+
+def test_check_raising_leaves_queue():
+    sched = SjfScheduler(1, aging=0)
+    sched.acquire(0)
+    cancel = threading.Event()
+
+    def check():
+        if cancel.is_set():
+            raise Cancelled()
+
+    order = []
+    # việc ngắn nhất bị huỷ trong lúc chờ: phải rời hàng đợi, không giữ slot
+    cancelled = enqueue(sched, 1, order, check)
+    other = enqueue(sched, 100, order)
+    wait_for(lambda: sched.pending() == 2)
+    cancel.set()
+    cancelled.join(5)
+    assert order == [("cancelled", 1)]
+    assert sched.pending() == 1
+    sched.release()
+    other.join(5)
+    assert order == [("cancelled", 1), 100]
+    assert sched.pending() == 0
+    # slot được trả đủ
+    assert sched.acquire(0) < 0.05
+
+
+@pytest.mark.parametrize("slots", [2, 3])
+def test_respects_slot_limit(slots):
+    sched = SjfScheduler(slots)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        sched.acquire(10)
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        sched.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(slots * 3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert max(peak) == slots